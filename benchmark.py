@@ -0,0 +1,248 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import functools
+import http.server
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+
+import main
+import sheets
+import tts
+import image_pipeline
+import instrumentation
+
+# Offline benchmark for the generation pipeline. The real stage functions from
+# main.py run against local stand-ins: a FakeSpreadsheet with N pending rows, a fake
+# TTS client that returns audio of a known length, a local HTTP server for the cover
+# image and a fixture image directory in place of the crawler. Every case runs in a
+# fresh process with its outputs under a temporary directory, so peak memory and
+# child (ffmpeg) memory are its own; the encoder is picked (calibrated if needed)
+# once before the first case. Results are written as JSON and can be compared
+# against an earlier run to flag regressions.
+#
+#   python benchmark.py --images 4 10 --audio 15 55 --backend moviepy ffmpeg stream
+#   python benchmark.py --compare benchmarks/results/baseline.json
+
+RESULTS_DIR = os.path.join("benchmarks", "results")
+FPS = 15
+SENTENCE = "Uống đủ nước mỗi ngày giúp cơ thể khỏe mạnh và tinh thần minh mẫn hơn."
+
+
+# Largest peak RSS of the finished child processes, in MB. The kernel keeps only
+# the maximum over all children, so it can be attributed to a stage only if it grew
+# during the stage; every case runs in a fresh process for this.
+def children_peak_rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+
+
+def measure(stages, name, fn):
+    children_before = children_peak_rss_mb()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    # A top-level span resets the peak RSS counter, and spans opened by fn nest in it
+    with instrumentation.span(name):
+        result = fn()
+    children_after = children_peak_rss_mb()
+    stages[name] = {
+        "wall_s": round(time.perf_counter() - wall_start, 4),
+        "cpu_s": round(time.process_time() - cpu_start, 4),
+        "peak_rss_mb": instrumentation.peak_rss_mb(),
+        # None: no child of this stage used more than the children of earlier stages
+        "children_peak_rss_mb": children_after if children_after > children_before else None,
+    }
+    return result
+
+
+# Deterministic JPEG fixtures (gradient + noise, camera-sized)
+def make_fixtures(directory, count, seed=1234, size=(2400, 1600)):
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        gradient = np.linspace(0, 255, size[0], dtype=np.float32)[None, :, None]
+        noise = rng.integers(0, 64, (size[1], size[0], 3), dtype=np.uint8)
+        pixels = np.clip(gradient * rng.random(3) + noise, 0, 255).astype(np.uint8)
+        path = os.path.join(directory, f"fixture_{i:03d}.jpg")
+        Image.fromarray(pixels).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+# Serve a directory over HTTP on localhost; returns (server, base_url)
+def serve_directory(directory):
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+# Content whose estimated speech duration is about `seconds`
+def make_content(seconds):
+    sentences = []
+    while tts.estimate_duration(" ".join(sentences)) < seconds:
+        sentences.append(SENTENCE)
+    return "\n".join(sentences)
+
+
+def make_sheet(rows, cover_url, content):
+    data = [["STT", "Nội dung", "", "Ảnh bìa", "", "", "", "Video", "Đã dùng"]]
+    for i in range(rows):
+        data.append([str(i + 1), f"Tiêu đề: Bài viết số {i + 1}\n{content}", "", cover_url, "", "", "", "", ""])
+    return sheets.FakeSpreadsheet({main.WORKSHEET_LIST[0]: data})
+
+
+# One case in this process; run it through run_case_isolated
+def run_case(num_images, audio_seconds, num_rows, backend, encoder, fixtures, base_url, work_root):
+    random.seed(0)
+    case_dir = tempfile.mkdtemp(dir=work_root)
+    # Fresh caches so every case measures cold stages
+    main.TTS_CACHE_DIR = os.path.join(case_dir, "cache", "tts")
+    main.IMAGE_CACHE_DIR = os.path.join(case_dir, "cache", "images")
+    main._tts_cache = None
+    main._image_cache = None
+    main.RENDER_BACKEND = backend
+    main.ENCODER_PROFILE = encoder
+    # Renditions and metrics stay out of the real output directory
+    main.output_dir = os.path.join(case_dir, "output")
+    main.renditions_dir = os.path.join(main.output_dir, "renditions")
+    instrumentation.METRICS_PATH = os.path.join(main.output_dir, "metrics.jsonl")
+    main.get_encoder_profile()
+
+    stages = {}
+    sheet_access = sheets.SheetAccess(make_sheet(num_rows, f"{base_url}/{os.path.basename(fixtures[0])}", make_content(audio_seconds)))
+    jobs = measure(stages, "scan", lambda: list(main.iter_pending_rows(sheet_access)))
+    title_text, content_text, bg_image_url = main.parse_row(jobs[0]["row"])
+
+    client = tts.FakeTTSClient(playable=True)
+    audio_path = os.path.join(case_dir, "voiceover.wav")
+    measure(stages, "tts", lambda: main.create_audio(content_text, audio_path, client=client))
+
+    title_image_path = os.path.join(case_dir, "title_image.jpg")
+    measure(stages, "title", lambda: main.create_title_image(title_text, bg_image_url, title_image_path))
+
+    frames = measure(stages, "images", lambda: image_pipeline.load_frames(fixtures[:num_images]))
+
+    output_path = os.path.join(case_dir, "output.mp4")
+    ok = measure(stages, "render", lambda: main.create_video([title_image_path] + frames, audio_path, output_path, "benchmark"))
+
+    duration = min(tts.wav_duration(audio_path), main.MAX_AUDIO_SECONDS)
+    render_wall = stages["render"]["wall_s"]
+    return {
+        "config": {"images": num_images, "audio_s": audio_seconds, "rows": num_rows, "backend": backend,
+                   "encoder": list(encoder)},
+        "ok": bool(ok),
+        "pending_rows": len(jobs),
+        "audio_s": round(duration, 2),
+        "render_fps": round(duration * FPS / render_wall, 2) if render_wall else None,
+        "output_bytes": os.path.getsize(output_path) if ok else None,
+        "stages": stages,
+    }
+
+
+# run_case in a fresh process, so its peak RSS and child peak are not an earlier case's
+def run_case_isolated(*args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(run_case, *args).result()
+
+
+def case_key(case):
+    config = case["config"]
+    return f"{config['backend']}/images={config['images']}/audio={config['audio_s']}/rows={config['rows']}"
+
+
+# Stages whose wall time grew by more than threshold against the baseline
+def compare(results, baseline, threshold):
+    regressions = []
+    old_cases = {case_key(case): case for case in baseline["cases"]}
+    for case in results["cases"]:
+        old = old_cases.get(case_key(case))
+        if not old:
+            continue
+        for stage, values in case["stages"].items():
+            old_wall = old["stages"].get(stage, {}).get("wall_s")
+            if old_wall and values["wall_s"] > old_wall * (1 + threshold) and values["wall_s"] - old_wall > 0.05:
+                regressions.append(f"{case_key(case)} {stage}: {old_wall:.3f}s -> {values['wall_s']:.3f}s")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the video generation pipeline")
+    parser.add_argument("--images", type=int, nargs="+", default=[4, 10], help="Crawled image counts to test")
+    parser.add_argument("--audio", type=float, nargs="+", default=[15, 55], help="Audio lengths in seconds")
+    parser.add_argument("--rows", type=int, default=50, help="Rows in the fake sheet")
+    parser.add_argument("--backend", nargs="+", default=[main.RENDER_BACKEND], choices=["moviepy", "ffmpeg", "stream"])
+    parser.add_argument("--fixtures", help="Directory of JPEG fixtures (generated when omitted)")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/bench_<time>.json)")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Relative slowdown flagged as a regression")
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+    work_root = tempfile.mkdtemp(prefix="shortvideo_bench_")
+    instrumentation.METRICS_PATH = os.path.join(work_root, "metrics.jsonl")
+    try:
+        # Calibrate (if this host has no cached calibration) before any case is timed
+        encoder = main.get_encoder_profile()
+        if args.fixtures:
+            fixtures = sorted(os.path.join(args.fixtures, name) for name in os.listdir(args.fixtures)
+                              if name.lower().endswith((".jpg", ".jpeg")))
+        else:
+            fixture_dir = os.path.join(work_root, "fixtures")
+            os.makedirs(fixture_dir)
+            fixtures = make_fixtures(fixture_dir, max(args.images))
+        server, base_url = serve_directory(os.path.dirname(fixtures[0]))
+
+        results = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+            "cases": [],
+        }
+        for backend in args.backend:
+            for num_images in args.images:
+                for audio_seconds in args.audio:
+                    print(f"\n=== {backend}: {num_images} images, {audio_seconds}s audio ===")
+                    case = run_case_isolated(num_images, audio_seconds, args.rows, backend, encoder,
+                                             fixtures, base_url, work_root)
+                    results["cases"].append(case)
+                    print(json.dumps(case, indent=2))
+        server.shutdown()
+    finally:
+        shutil.rmtree(work_root, ignore_errors=True)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nSaved benchmark results to {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("Regressions:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("No regressions.")
+
+
+if __name__ == "__main__":
+    run()
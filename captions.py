@@ -0,0 +1,109 @@
+import os
+import tts
+
+# Burned-in captions timed from the TTS audio. The voiceover is synthesized in
+# chunks whose real durations are read from their WAV headers; inside a chunk the
+# time is shared out over its sentences by character count (the same speech-rate
+# model as tts.estimate_duration), so the error never carries over a chunk boundary.
+# The cues are written as an ASS file and drawn by ffmpeg's libass filter in the
+# encode that already runs, so captions add no extra pass over the frames.
+
+FONT_NAME = "DejaVu Sans"  # fonts-dejavu-core, installed by the workflow
+FONT_SIZE = 46
+MARGIN_V = 170  # Distance of the caption block from the bottom of the frame
+MAX_CUE_CHARS = 70  # Longer sentences are split at word boundaries into several cues
+MIN_CUE_SECONDS = 0.6  # A cue that would start closer than this to the cut is dropped
+OPTION_SPECIAL = "\\':"  # Escaped inside a filter option value
+GRAPH_SPECIAL = "\\'[],;"  # Escaped again inside a filtergraph
+
+ASS_HEADER = """[Script Info]
+ScriptType: v4.00+
+PlayResX: {width}
+PlayResY: {height}
+WrapStyle: 0
+ScaledBorderAndShadow: yes
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,{font},{size},&H00FFFFFF,&H000000FF,&H00000000,&H80000000,-1,0,0,0,100,100,0,0,1,3,1,2,50,50,{margin},1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+
+# Split text at word boundaries into parts of at most max_chars, of similar length
+def split_cue_text(text, max_chars=MAX_CUE_CHARS):
+    words = text.split()
+    parts_needed = max(1, -(-len(text) // max_chars))
+    target = len(text) / parts_needed
+    parts = []
+    current = ""
+    for word in words:
+        candidate = f"{current} {word}" if current else word
+        if current and len(candidate) > target and len(parts) < parts_needed - 1:
+            parts.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        parts.append(current)
+    return parts
+
+
+# (start, end, text) cues for chunks of speech joined back to back: chunk_texts are
+# the TTS request texts and chunk_durations the seconds of audio each produced.
+# Cues past max_seconds (where the audio is cut) are dropped or shortened.
+def build_cues(chunk_texts, chunk_durations, max_seconds=None):
+    cues = []
+    offset = 0.0
+    for text, duration in zip(chunk_texts, chunk_durations):
+        pieces = [piece for sentence in tts.split_sentences(text) for piece in split_cue_text(sentence)]
+        total_chars = sum(len(piece) for piece in pieces)
+        start = offset
+        for piece in pieces:
+            end = start + duration * len(piece) / total_chars
+            cues.append((start, end, piece))
+            start = end
+        offset += duration
+
+    if max_seconds is not None:
+        cues = [(start, min(end, max_seconds), text) for start, end, text in cues
+                if start < max_seconds - MIN_CUE_SECONDS]
+    return cues
+
+
+def format_time(seconds):
+    centiseconds = int(round(seconds * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    return f"{hours}:{minutes:02d}:{centiseconds // 100:02d}.{centiseconds % 100:02d}"
+
+
+# Caption text with ASS override braces and line breaks neutralized
+def escape_text(text):
+    return text.replace("\\", "/").replace("{", "(").replace("}", ")").replace("\n", " ")
+
+
+def write_ass(cues, path, width=720, height=1280):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(ASS_HEADER.format(width=width, height=height, font=FONT_NAME, size=FONT_SIZE, margin=MARGIN_V))
+        for start, end, text in cues:
+            f.write(f"Dialogue: 0,{format_time(start)},{format_time(end)},Default,,0,0,0,,{escape_text(text)}\n")
+    return path
+
+
+# Caption file that goes with a voiceover file
+def captions_path(audio_path):
+    return f"{os.path.splitext(audio_path)[0]}.ass"
+
+
+def _escape(value, special):
+    return "".join(f"\\{char}" if char in special else char for char in value)
+
+
+# ffmpeg filter that burns in an ASS file; the path is escaped for the filter option
+# and then for the filtergraph, so any file name works inside -filter_complex or -vf
+def caption_filter(path):
+    value = _escape(_escape(path.replace(os.sep, "/"), OPTION_SPECIAL), GRAPH_SPECIAL)
+    return f"ass=filename={value}"
@@ -1,59 +1,81 @@
 import os
-import gspread
-from google.oauth2.service_account import Credentials
-import subprocess
+import sheets
+import manifest
+import instrumentation
 from urllib.parse import urlparse, unquote
 
 # Directory setup
 output_dir = "output"
 
-# Read from Google Sheets
-print("Reading from Google Sheets to find used videos...")
-scopes = ['https://www.googleapis.com/auth/spreadsheets']
-creds = Credentials.from_service_account_file('google_sheets_key.json', scopes=scopes)
-gc = gspread.authorize(creds)
-
-SHEET_ID = '14tqKftTqlesnb0NqJZU-_f1EsWWywYqO36NiuDdmaTo'
-worksheet = gc.open_by_key(SHEET_ID).worksheet('Phòng mạch')
-
-rows = worksheet.get_all_values()
-files_to_delete = []
-
-# Process rows to find those with non-empty column I
-for i, row in enumerate(rows):
-    if i == 0:  # Skip header
-        continue
-    if len(row) > 8 and row[8] and row[8].strip() != '':  # Check if column I is non-empty
-        video_url = row[7] if len(row) > 7 else ''  # Column H (URL)
-        if not video_url:
-            print(f"  Row {i + 1}: No URL found in column H. Skipping.")
+
+# Video path for a used row: from the manifest's URL index, or parsed from the URL
+# for videos published before the manifest existed
+def video_for_url(artifacts, video_url):
+    artifact = artifacts.find_by_url(video_url)
+    if artifact:
+        return artifact["path"]
+    parsed_url = urlparse(video_url)
+    return manifest.artifact_path(os.path.join(output_dir, unquote(os.path.basename(parsed_url.path))))
+
+
+# Recorded as one instrumentation span
+with instrumentation.span("delete_used"):
+    artifacts = manifest.Manifest()
+    print("Reading from Google Sheets to find used videos...")
+    sheet_access = sheets.SheetAccess(sheets.open_spreadsheet())
+
+    # Published videos in the manifest: only their own rows are read (H to check the
+    # row still holds that video, I for the used flag)
+    published = [artifact for artifact in artifacts.live()
+                 if artifact.get("url") and artifact.get("worksheet") and artifact.get("row")]
+    rows_by_worksheet = {}
+    for artifact in published:
+        rows_by_worksheet.setdefault(artifact["worksheet"], []).append(artifact["row"])
+    cells = sheet_access.fetch_cells(rows_by_worksheet, columns=("H", "I"))
+
+    used_urls = []
+    full_scan = False
+    for artifact in published:
+        row = cells.get((artifact["worksheet"], artifact["row"]))
+        if row is None or row[7] != artifact["url"]:
+            full_scan = True  # Rows moved or the worksheet is gone
             continue
-        # Extract filename from URL
-        parsed_url = urlparse(video_url)
-        filename = unquote(os.path.basename(parsed_url.path))
-        video_file = os.path.join(output_dir, filename)
-        if os.path.exists(video_file):
-            files_to_delete.append(video_file)
-            print(f"  Found video to delete: {video_file} (from URL: {video_url})")
-        else:
+        if row[8] and row[8].strip() != '':
+            used_urls.append(artifact["url"])
+
+    # Videos without a manifest row (older videos, or rows that moved) need the full column scan
+    known = {artifact["path"] for artifact in published}
+    if not full_scan:
+        full_scan = any(manifest.artifact_path(os.path.join(output_dir, name)) not in known
+                        for name in os.listdir(output_dir) if name.startswith("output_video_") and name.endswith(".mp4"))
+    if full_scan:
+        print("  Some videos are not indexed by sheet row; scanning columns H and I.")
+        # Only columns H (URL) and I (used flag) are needed
+        rows = sheet_access.fetch_rows(['Phòng mạch'], columns=("H", "I")).get('Phòng mạch', [])
+        for i, row in enumerate(rows):
+            if row[8] and row[8].strip() != '':  # Check if column I is non-empty
+                if not row[7]:
+                    print(f"  Row {i + 2}: No URL found in column H. Skipping.")
+                    continue
+                used_urls.append(row[7])
+
+    used = []
+    for video_url in dict.fromkeys(used_urls):
+        video_file = video_for_url(artifacts, video_url)
+        artifact = artifacts.get(video_file)
+        if artifact and artifact["state"] == "deleted":
+            continue
+        if not os.path.exists(video_file):
             print(f"  Video not found: {video_file} (from URL: {video_url})")
+            continue
+        print(f"  Found video to delete: {video_file} (from URL: {video_url})")
+        if not artifact or artifact["state"] != "used":
+            artifacts.record("used", video_file, url=video_url)
+        used.append({"path": video_file})
 
-# Delete files and commit changes
-if files_to_delete:
-    print("Deleting used video files...")
-    for file in files_to_delete:
-        try:
-            subprocess.run(["git", "rm", file], check=True)
-            print(f"  Removed {file} from git")
-        except subprocess.CalledProcessError as e:
-            print(f"  Warning: Failed to remove {file}: {e}")
-    
-    # Commit the deletions
-    try:
-        subprocess.run(["git", "commit", "-m", "Delete used videos based on Google Sheet column I"], check=True)
-        subprocess.run(["git", "push"], check=True)
-        print("  Committed and pushed deletions")
-    except subprocess.CalledProcessError as e:
-        print(f"  Warning: Failed to commit/push deletions: {e}")
-else:
-    print("No used videos to delete.")
+    # Delete files and commit changes
+    if used:
+        print("Deleting used video files...")
+        manifest.delete_artifacts(artifacts, used, "used", "Delete used videos based on Google Sheet column I")
+    else:
+        print("No used videos to delete.")
@@ -0,0 +1,89 @@
+import os
+
+# Size-budgeted encoding. Videos are delivered as raw GitHub files and must stay under
+# TARGET_SIZE_MB, so instead of a fixed bitrate the video bitrate is derived from the
+# budget and the (known) audio duration, after reserving room for the AAC track and
+# the mp4 container. The bitrate is then enforced either with capped VBV (single
+# pass, the encoder may never exceed the rate over one second of video) or with a
+# two-pass encode whose first pass is a fast analysis run.
+#
+#   fixed     the old behaviour: -b:v FIXED_VIDEO_BITRATE, no guarantee
+#   vbv       -b:v/-maxrate at the budget rate, 1 second VBV buffer
+#   two_pass  analysis pass + budget-rate second pass (not on the moviepy backend)
+
+TARGET_SIZE_MB = 5  # Same MB (1024 * 1024 bytes) as the ">5MB" check in update_sheet.py
+ENCODE_MODES = ("fixed", "vbv", "two_pass")
+FIXED_VIDEO_BITRATE = "700k"
+MAX_VIDEO_KBPS = 700  # Short videos do not need more than the old fixed rate
+MIN_VIDEO_KBPS = 150
+CONTAINER_OVERHEAD = 0.02  # mp4 headers, index and interleaving, as a share of the budget
+SAFETY_MARGIN = 0.04  # Rate control slack (VBV buffer fill, rounding)
+
+
+def parse_kbps(bitrate):
+    bitrate = str(bitrate).strip().lower()
+    if bitrate.endswith("k"):
+        return float(bitrate[:-1])
+    if bitrate.endswith("m"):
+        return float(bitrate[:-1]) * 1000
+    return float(bitrate) / 1000
+
+
+def target_bytes(target_mb=TARGET_SIZE_MB):
+    return int(target_mb * 1024 * 1024)
+
+
+# Video bitrate (kbit/s) that keeps a video of `duration` seconds, with an audio track
+# of `audio_bitrate`, under target_mb
+def budget_video_kbps(duration, target_mb=TARGET_SIZE_MB, audio_bitrate="96k"):
+    if duration <= 0:
+        raise ValueError(f"Invalid duration: {duration}")
+    usable_bits = target_bytes(target_mb) * 8 * (1 - CONTAINER_OVERHEAD - SAFETY_MARGIN)
+    total_kbps = usable_bits / duration / 1000
+    video_kbps = int(total_kbps - parse_kbps(audio_bitrate))
+    if video_kbps < MIN_VIDEO_KBPS:
+        raise ValueError(f"{duration:.1f}s does not fit in {target_mb} MB at {MIN_VIDEO_KBPS}k video")
+    return min(video_kbps, MAX_VIDEO_KBPS)
+
+
+# Rate-control arguments that go with -b:v for one encode. pass_number is 1 or 2 for
+# two_pass; stats_path is the pass log shared by both passes.
+def rate_control_args(codec, bitrate, mode="vbv", pass_number=None, stats_path=None):
+    if mode not in ENCODE_MODES:
+        raise ValueError(f"Unknown encode mode: {mode}")
+    if mode == "fixed":
+        return []
+    if mode == "vbv":
+        # maxrate == bitrate with a one second buffer: no stretch of video may overshoot
+        return ["-maxrate", bitrate, "-bufsize", bitrate]
+
+    if pass_number not in (1, 2) or not stats_path:
+        raise ValueError("two_pass needs pass_number (1 or 2) and stats_path")
+    if codec == "libx265":
+        x265_params = f"pass={pass_number}:stats={stats_path}"
+        if pass_number == 1:
+            x265_params += ":slow-firstpass=0"  # Analysis only, keep it cheap
+        return ["-x265-params", x265_params]
+    return ["-pass", str(pass_number), "-passlogfile", stats_path]
+
+
+# Video encoder arguments (everything after -c:v)
+def video_args(codec, bitrate, preset, mode="vbv", pass_number=None, stats_path=None):
+    return ["-b:v", bitrate, "-preset", preset] + rate_control_args(codec, bitrate, mode, pass_number, stats_path)
+
+
+# Video bitrate for an encode mode: the old fixed rate, or the budget rate for the duration
+def video_bitrate(mode, duration, target_mb=TARGET_SIZE_MB, audio_bitrate="96k"):
+    if mode == "fixed":
+        return FIXED_VIDEO_BITRATE
+    return f"{budget_video_kbps(duration, target_mb, audio_bitrate)}k"
+
+
+# Output arguments for the discarded first pass
+def null_output():
+    return ["-an", "-f", "null", os.devnull]
+
+
+# Bytes over the budget (0 when it fits)
+def overshoot(path, target_mb=TARGET_SIZE_MB):
+    return max(0, os.path.getsize(path) - target_bytes(target_mb))
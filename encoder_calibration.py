@@ -0,0 +1,182 @@
+import os
+import re
+import json
+import time
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import instrumentation
+import encode_budget
+import ffmpeg_render
+
+# Per-host choice of video encoder. A short synthetic clip is rendered with the
+# transitions of the real videos (ffmpeg_render filtergraph) and kept losslessly as
+# the reference, then encoded with every candidate codec/preset at the tightest size
+# budget (the longest video) with capped VBV, like the render stage does. Encode
+# speed, bitrate and SSIM against the reference are recorded. The fastest candidate
+# whose SSIM is at most MAX_SSIM_LOSS below that of DEFAULT_PROFILE (the encoder used
+# before calibration existed) is used. Results are cached per CPU model and ffmpeg
+# version, so a host calibrates once and the render stage only reads the cache.
+#
+#   python main.py --calibrate
+
+CALIBRATION_PATH = os.path.join("cache", "encoder_calibration.json")
+CALIBRATION_MAX_AGE = 30 * 24 * 60 * 60  # Seconds before a host is calibrated again
+CANDIDATES = [
+    ("libx265", "medium"),
+    ("libx265", "fast"),
+    ("libx265", "veryfast"),
+    ("libx264", "slow"),
+    ("libx264", "medium"),
+    ("libx264", "fast"),
+    ("libx264", "veryfast"),
+]
+DEFAULT_PROFILE = ("libx265", "medium")  # Quality baseline, and the fallback without a calibration
+MAX_SSIM_LOSS = 0.005  # Quality target: SSIM at the budget bitrate may drop this much below the baseline
+CLIP_SECONDS = 4.5
+CLIP_FPS = 15
+CLIP_IMAGES = 3
+CLIP_TRANSITIONS = ("zoom_in", "pan_left", "zoom_out")
+
+
+# CPU model and ffmpeg version: the calibration is only valid for this pair
+def host_key():
+    cpu = platform.processor() or platform.machine()
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            match = re.search(r"^model name\s*:\s*(.+)$", f.read(), re.MULTILINE)
+            if match:
+                cpu = match.group(1).strip()
+    except OSError:
+        pass
+    result = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True)
+    match = re.search(r"ffmpeg version (\S+)", result.stdout) if result.returncode == 0 else None
+    return f"{cpu} | {os.cpu_count()} cpu | ffmpeg {match.group(1) if match else 'unknown'}"
+
+
+# Photo-like test images: smooth gradients with fine texture and a few hard edges,
+# deterministic so every host encodes the same content
+def synthetic_frames(count=CLIP_IMAGES, width=ffmpeg_render.FRAME_WIDTH, height=ffmpeg_render.FRAME_HEIGHT):
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    frames = []
+    for i in range(count):
+        base = np.stack([x / width, y / height, (x + y) / (width + height)], axis=-1) * 200
+        texture = 25 * np.sin(x / (7 + i) + np.sin(y / 23))[..., None]
+        blocks = (((x // (90 + 20 * i)) + (y // 120)) % 2 == 0)[..., None] * 30
+        noise = rng.normal(0, 3, (height, width, 3))
+        frames.append(np.clip(base + texture + blocks + noise, 0, 255).astype(np.uint8))
+    return frames
+
+
+# Lossless reference clip rendered with the production filtergraph
+def render_reference(temp_dir):
+    reference = os.path.join(temp_dir, "reference.mkv")
+    duration = CLIP_SECONDS / CLIP_IMAGES
+    cmd = ["ffmpeg", "-y", "-hide_banner"]
+    plan = []
+    for i, frame in enumerate(synthetic_frames()):
+        path = os.path.join(temp_dir, f"frame{i}.rgb")
+        frame.tofile(path)
+        image = ffmpeg_render.RawFrame(path, frame.shape[1], frame.shape[0])
+        plan.append((image, duration, CLIP_TRANSITIONS[i % len(CLIP_TRANSITIONS)]))
+        cmd += ffmpeg_render.image_input(image, duration, CLIP_FPS)
+    cmd += ["-filter_complex", ffmpeg_render.build_filtergraph(plan, CLIP_FPS), "-map", "[v]",
+            "-c:v", "ffv1", "-r", str(CLIP_FPS), reference]
+    subprocess.run(cmd, check=True, capture_output=True)
+    return reference
+
+
+def measure_ssim(encoded, reference):
+    result = subprocess.run(["ffmpeg", "-hide_banner", "-i", encoded, "-i", reference,
+                             "-lavfi", "[0:v][1:v]ssim", "-f", "null", os.devnull],
+                            capture_output=True, text=True)
+    match = re.search(r"All:([0-9.]+)", result.stderr)
+    return float(match.group(1)) if match else None
+
+
+# Encode the reference with one candidate; returns its measurements
+def measure(codec, preset, reference, bitrate, temp_dir):
+    output = os.path.join(temp_dir, f"{codec}_{preset}.mp4")
+    cmd = ["ffmpeg", "-y", "-hide_banner", "-i", reference, "-c:v", codec]
+    cmd += encode_budget.video_args(codec, bitrate, preset, "vbv") + ["-pix_fmt", "yuv420p", output]
+    start = time.perf_counter()
+    subprocess.run(cmd, check=True, capture_output=True)
+    elapsed = time.perf_counter() - start
+    return {
+        "codec": codec,
+        "preset": preset,
+        "speed": round(CLIP_SECONDS / elapsed, 3),  # Seconds of video encoded per second
+        "kbps": round(os.path.getsize(output) * 8 / CLIP_SECONDS / 1000, 1),
+        "ssim": measure_ssim(output, reference),
+    }
+
+
+# Measure every candidate on this host at the video bitrate of a max_seconds video
+def calibrate(max_seconds=55, target_mb=encode_budget.TARGET_SIZE_MB, candidates=CANDIDATES):
+    bitrate = encode_budget.video_bitrate("vbv", max_seconds, target_mb)
+    results = []
+    with instrumentation.span("calibrate", bitrate=bitrate), tempfile.TemporaryDirectory() as temp_dir:
+        reference = render_reference(temp_dir)
+        for codec, preset in candidates:
+            try:
+                result = measure(codec, preset, reference, bitrate, temp_dir)
+            except subprocess.CalledProcessError as e:
+                print(f"  Warning: {codec} {preset} failed to encode: {e}")
+                continue
+            print(f"  {codec:8} {preset:9} {result['speed']:6.2f}x realtime  {result['kbps']:7.1f} kbps  SSIM {result['ssim']}")
+            results.append(result)
+    return {"measured_at": round(time.time(), 3), "bitrate": bitrate, "results": results}
+
+
+def load_calibrations(path=CALIBRATION_PATH):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_calibration(key, calibration, path=CALIBRATION_PATH):
+    calibrations = load_calibrations(path)
+    calibrations[key] = calibration
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(calibrations, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+# Fastest measured candidate within max_ssim_loss of the baseline's SSIM (the best
+# SSIM measured if the baseline is missing) that stays within the budget bitrate
+def select_profile(calibration, max_ssim_loss=MAX_SSIM_LOSS):
+    results = [result for result in calibration["results"] if result["ssim"] is not None]
+    if not results:
+        return None
+    baseline = next((result["ssim"] for result in results
+                     if (result["codec"], result["preset"]) == DEFAULT_PROFILE), None)
+    if baseline is None:
+        baseline = max(result["ssim"] for result in results)
+    budget_kbps = encode_budget.parse_kbps(calibration["bitrate"])
+    eligible = [result for result in results
+                if result["ssim"] >= baseline - max_ssim_loss and result["kbps"] <= budget_kbps * 1.05]
+    if not eligible:
+        return None
+    return max(eligible, key=lambda result: result["speed"])
+
+
+# (codec, preset, result) for this host, calibrating first when there is no fresh
+# calibration (or force is set). result is None when the default profile is used.
+def host_profile(force=False, max_ssim_loss=MAX_SSIM_LOSS, max_seconds=55, target_mb=encode_budget.TARGET_SIZE_MB,
+                 path=CALIBRATION_PATH):
+    key = host_key()
+    calibration = load_calibrations(path).get(key)
+    if force or not calibration or time.time() - calibration["measured_at"] > CALIBRATION_MAX_AGE:
+        print(f"Calibrating video encoders for {key}...")
+        calibration = calibrate(max_seconds, target_mb)
+        save_calibration(key, calibration, path)
+    result = select_profile(calibration, max_ssim_loss)
+    if result is None:
+        return DEFAULT_PROFILE + (None,)
+    return result["codec"], result["preset"], result
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+
+# Persistent store for normalized 720x1280 frames. Frames are content-addressed
+# (sha256 of the pixels) and stored as .npy; small index files map a cover URL or a
+# crawl keyword to the frames it produced. Index entries expire after ttl seconds and
+# frames are evicted least recently used once the store exceeds max_bytes, the same
+# way TTSCache does it (file mtime is the LRU clock).
+
+DEFAULT_CACHE_DIR = os.path.join("cache", "images")
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 14 * 24 * 60 * 60
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _atomic_write(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        write(f)
+    os.replace(temp_path, path)
+
+
+class ImageCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES, ttl=DEFAULT_TTL_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _frame_path(self, frame_id):
+        return os.path.join(self.cache_dir, "frames", frame_id[:2], f"{frame_id}.npy")
+
+    def _index_path(self, kind, key):
+        return os.path.join(self.cache_dir, "index", kind, f"{_digest(key.encode('utf-8'))}.json")
+
+    def _store_frame(self, frame):
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        frame_id = _digest(frame.tobytes() + repr(frame.shape).encode())
+        path = self._frame_path(frame_id)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            _atomic_write(path, lambda f: np.save(f, frame, allow_pickle=False))
+        return frame_id
+
+    def _load_frame(self, frame_id):
+        path = self._frame_path(frame_id)
+        frame = np.load(path, allow_pickle=False)
+        os.utime(path)  # Mark as recently used
+        return frame
+
+    def _frame_ids(self, kind, key):
+        path = self._index_path(kind, key)
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        if time.time() - entry["created"] > self.ttl:
+            os.remove(path)
+            raise FileNotFoundError(path)
+        return entry["frames"]
+
+    # Frames stored under (kind, key), or None if missing, expired or partly evicted
+    def get(self, kind, key):
+        try:
+            frames = [self._load_frame(frame_id) for frame_id in self._frame_ids(kind, key)]
+        except (FileNotFoundError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return frames
+
+    # Like get, but the paths of the .npy files, for callers that load one frame at a time
+    def get_paths(self, kind, key):
+        try:
+            paths = []
+            for frame_id in self._frame_ids(kind, key):
+                path = self._frame_path(frame_id)
+                os.utime(path)  # Fails if evicted; marks it as recently used
+                paths.append(path)
+        except (FileNotFoundError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return paths
+
+    # Store frames under (kind, key); returns the paths of their .npy files
+    def put(self, kind, key, frames):
+        entry = {"key": key, "created": time.time(), "frames": [self._store_frame(frame) for frame in frames]}
+        _atomic_write(self._index_path(kind, key), lambda f: f.write(json.dumps(entry, ensure_ascii=False).encode("utf-8")))
+        self.evict()
+        return [self._frame_path(frame_id) for frame_id in entry["frames"]]
+
+    def get_cover(self, url):
+        frames = self.get("cover", url)
+        return frames[0] if frames else None
+
+    def put_cover(self, url, frame):
+        self.put("cover", url, [frame])
+
+    def get_keyword(self, keyword):
+        return self.get("keyword", keyword)
+
+    def get_keyword_paths(self, keyword):
+        return self.get_paths("keyword", keyword)
+
+    def put_keyword(self, keyword, frames):
+        return self.put("keyword", keyword, frames)
+
+    def _files(self, subdir, suffix):
+        files = []
+        for root, _, names in os.walk(os.path.join(self.cache_dir, subdir)):
+            for name in names:
+                if not name.endswith(suffix):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def evict(self):
+        now = time.time()
+        for mtime, _, path in self._files("index", ".json"):
+            if now - mtime > self.ttl:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+        frames = self._files("frames", ".npy")
+        total = sum(size for _, size, _ in frames)
+        for _, size, path in sorted(frames):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
@@ -0,0 +1,212 @@
+import time
+import queue
+import threading
+import contextvars
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from PIL import Image
+from icrawler import ImageDownloader
+from icrawler.builtin import GoogleImageCrawler
+import instrumentation
+import image_pipeline
+
+# Streaming image crawl for the render stage. The icrawler downloader screens every
+# image as it arrives: the size check (dimensions, aspect ratio) runs as soon as the
+# header has been received, so a rejected image is dropped after its first chunks;
+# accepted ones are read in full, compared by a draft-decoded thumbnail (difference
+# hash against the images already accepted) and put on a queue. The stage normalizes them on a thread pool while the
+# crawl continues, and cancels the crawl (icrawler's reach_max_num signal) once
+# enough frames are ready or the time budget runs out, so one slow host cannot hold
+# the stage until every download has finished.
+
+MIN_ASPECT = 0.4  # Width / height; narrower images lose too much to the 9:16 cover crop...
+MAX_ASPECT = 2.0  # ...and so do wider panoramas
+HASH_SIZE = 8  # Difference hash of HASH_SIZE x HASH_SIZE bits
+DUPLICATE_DISTANCE = 6  # Hashes closer than this (in bits) are the same picture
+TIME_BUDGET = 45.0  # Seconds before the crawl is cancelled with what it has
+CRAWL_OVERSAMPLE = 3  # Results requested per needed image, so rejects can be replaced
+CHUNK_SIZE = 16 * 1024  # Bytes read at a time while waiting for the header
+MAX_HEADER_BYTES = 512 * 1024  # An image whose header is not parsed within this is unreadable
+
+
+# Difference hash: each bit tells whether a pixel of a small grayscale thumbnail is
+# brighter than its right neighbour. JPEGs are draft-decoded at 1/8 scale.
+def dhash(img, hash_size=HASH_SIZE):
+    img.draft("L", (hash_size * 8, hash_size * 8))
+    pixels = list(img.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR).getdata())
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            bits = (bits << 1) | (left > pixels[row * (hash_size + 1) + col + 1])
+    return bits
+
+
+# Reason to drop an image of this size, or None
+def screen_size(size, min_size):
+    width, height = size
+    if min_size and min(width, height) < min(min_size):
+        return "too small"
+    if not MIN_ASPECT <= width / height <= MAX_ASPECT:
+        return "aspect ratio"
+    return None
+
+
+# Shared state of one crawl: accepted hashes, the handoff queue and the stop flag
+class CrawlScreen:
+    def __init__(self, min_size=None):
+        self.min_size = min_size
+        self.queue = queue.Queue()
+        self.stopped = threading.Event()
+        self.hashes = []
+        self.rejected = {}
+        self._lock = threading.Lock()
+
+    def _reject(self, reason):
+        with self._lock:
+            self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        instrumentation.count("images_rejected")
+        return False
+
+    # Screen one image while it downloads (chunks: iterable of bytes). Reading stops
+    # at the header if the size check rejects it; accepted ones go on the queue.
+    # Errors raised by chunks (the connection) propagate.
+    def offer(self, chunks):
+        if self.stopped.is_set():
+            return False
+        chunks = iter(chunks)
+        buffer = bytearray()
+        size = None
+        for chunk in chunks:
+            buffer += chunk
+            try:
+                size = Image.open(BytesIO(buffer)).size  # Parses the header only
+                break
+            except Exception:
+                if len(buffer) >= MAX_HEADER_BYTES:
+                    break
+        reason = "unreadable" if size is None else screen_size(size, self.min_size)
+        if not reason:
+            for chunk in chunks:
+                buffer += chunk
+                if self.stopped.is_set():
+                    break
+        instrumentation.count("bytes_downloaded", len(buffer))
+        if reason:
+            return self._reject(reason)
+        if self.stopped.is_set():
+            return False
+        content = bytes(buffer)
+        try:
+            image_hash = dhash(Image.open(BytesIO(content)))
+        except Exception:
+            return self._reject("unreadable")
+        with self._lock:
+            if any(bin(image_hash ^ other).count("1") < DUPLICATE_DISTANCE for other in self.hashes):
+                duplicate = True
+            else:
+                duplicate = False
+                self.hashes.append(image_hash)
+        if duplicate:
+            return self._reject("duplicate")
+        instrumentation.count("images_downloaded")
+        self.queue.put(content)
+        return True
+
+
+# icrawler downloader that streams every response into the crawl's CrawlScreen instead
+# of downloading it in full and writing it to storage (set crawler.downloader.screen,
+# and context to carry instrumentation spans into its threads, before crawling)
+class ScreeningDownloader(ImageDownloader):
+    screen = None
+    context = None
+
+    def worker_exec(self, *args, **kwargs):
+        if self.context is None:
+            return super().worker_exec(*args, **kwargs)
+        # A context can only be entered by one thread at a time
+        return self.context.copy().run(super().worker_exec, *args, **kwargs)
+
+    def download(self, task, default_ext, timeout=5, max_retry=3, overwrite=False, **kwargs):
+        task["success"] = False
+        task["filename"] = None
+        for retry in range(max_retry, 0, -1):
+            if self.signal.get("reach_max_num") or self.screen.stopped.is_set():
+                return False
+            try:
+                with self.session.get(task["file_url"], timeout=timeout, stream=True) as response:
+                    if response.status_code != 200:
+                        self.logger.error("Response status code %d, file %s", response.status_code, task["file_url"])
+                        return False
+                    # Leaving the block closes the connection of a rejected image
+                    if not self.screen.offer(response.iter_content(CHUNK_SIZE)):
+                        return False
+            except Exception as e:
+                self.logger.error("Exception caught when downloading file %s, error: %s, remaining retry times: %d",
+                                  task["file_url"], e, retry - 1)
+                continue
+            with self.lock:
+                self.fetched_num += 1
+            if self.reach_max_num():
+                self.signal.set(reach_max_num=True)
+            task["success"] = True
+            return True
+        return False
+
+
+# Crawl images for keyword and return up to num_images normalized frames, in the order
+# they finished normalizing. Stops after time_budget seconds with what it has.
+def crawl_frames(keyword, num_images, work_dir, min_size=(500, 500), time_budget=TIME_BUDGET,
+                 normalize_workers=image_pipeline.NORMALIZE_WORKERS):
+    screen = CrawlScreen(min_size)
+    crawler = GoogleImageCrawler(downloader_cls=ScreeningDownloader, storage={'root_dir': work_dir})
+    crawler.downloader.screen = screen
+    crawler.downloader.context = contextvars.copy_context()
+    errors = []
+
+    def crawl():
+        try:
+            crawler.crawl(keyword=keyword, max_num=num_images * CRAWL_OVERSAMPLE, min_size=min_size)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=crawl, name="image-crawl", daemon=True)
+    thread.start()
+    deadline = time.monotonic() + time_budget
+    frames = []
+    normalizing = set()
+    with ThreadPoolExecutor(max_workers=normalize_workers) as pool:
+        try:
+            while len(frames) < num_images and time.monotonic() < deadline:
+                try:
+                    while len(frames) + len(normalizing) < num_images:
+                        content = screen.queue.get_nowait()
+                        normalizing.add(pool.submit(image_pipeline.load_frame, BytesIO(content)))
+                except queue.Empty:
+                    pass
+                if not normalizing and not thread.is_alive() and screen.queue.empty():
+                    break  # The crawl ran out of results
+                if not normalizing:
+                    time.sleep(0.1)
+                    continue
+                done, normalizing = wait(normalizing, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        frames.append(future.result())
+                    except Exception as e:
+                        print(f"  Warning: Failed to process crawled image: {e}")
+        finally:
+            # Cancel the crawl: downloads in flight are dropped by the screen and the
+            # icrawler threads exit at their next signal check
+            screen.stopped.set()
+            crawler.signal.set(reach_max_num=True)
+            for future in normalizing:
+                future.cancel()
+
+    if time.monotonic() >= deadline and len(frames) < num_images:
+        print(f"  Crawl time budget of {time_budget:.0f}s reached with {len(frames)} image(s)")
+    if screen.rejected:
+        print(f"  Rejected crawled images: {', '.join(f'{count} {reason}' for reason, count in sorted(screen.rejected.items()))}")
+    if errors and not frames:
+        raise errors[0]
+    return frames[:num_images]
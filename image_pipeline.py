@@ -0,0 +1,58 @@
+import math
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+# Image normalization for the render stage: every source is cover-fitted and
+# center-cropped to 720x1280 RGB. JPEGs are decoded in draft mode (libjpeg DCT
+# scaling by 1/2, 1/4 or 1/8) so multi-megapixel files are never fully decoded, and
+# only the visible crop box is resampled.
+
+FRAME_SIZE = (720, 1280)
+NORMALIZE_WORKERS = 4
+
+
+# Cover-fit one image (path, file object or PIL image) to size; returns a PIL image
+def normalize_image(source, size=FRAME_SIZE):
+    img = source if isinstance(source, Image.Image) else Image.open(source)
+    width, height = size
+    scale = max(width / img.width, height / img.height)
+    if img.format == "JPEG":
+        # Smallest DCT scale that still covers the target size
+        img.draft("RGB", (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+    img = img.convert("RGB")
+
+    # Crop box in source pixels that maps onto the target frame
+    scale = max(width / img.width, height / img.height)
+    box_width, box_height = width / scale, height / scale
+    left = (img.width - box_width) / 2
+    top = (img.height - box_height) / 2
+    return img.resize(size, Image.LANCZOS, box=(left, top, left + box_width, top + box_height), reducing_gap=3.0)
+
+
+# Normalized HxWx3 uint8 frame for the render stage
+def load_frame(source, size=FRAME_SIZE):
+    return np.asarray(normalize_image(source, size))
+
+
+# Normalize many images on a thread pool (Pillow releases the GIL while decoding and
+# resampling). Returns one frame per source in order, or None where a source failed.
+def load_frames(sources, size=FRAME_SIZE, max_workers=NORMALIZE_WORKERS):
+    def load(source):
+        try:
+            return load_frame(source, size)
+        except Exception as e:
+            print(f"  Warning: Failed to process image {source}: {e}")
+            return None
+
+    if not sources:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(sources))) as pool:
+        return list(pool.map(load, sources))
+
+
+# Label for log lines: the file path, or the frame size for in-memory frames
+def describe(image):
+    if isinstance(image, np.ndarray):
+        return f"<frame {image.shape[1]}x{image.shape[0]}>"
+    return image
@@ -0,0 +1,196 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import resource
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Structured timing and resource instrumentation. Each span records wall time, the
+# CPU time of the thread it ran on, counters (bytes downloaded/written, API calls,
+# ...) and process-wide figures: CPU time of this process and of finished child
+# processes such as ffmpeg, and peak RSS. Spans nest per thread/context; counters go
+# to the innermost open span. Stages run concurrently, so the process_* fields of a
+# nested span include whatever else ran meanwhile; only a top-level span (at most one
+# at a time per process) has the process to itself, and its peak RSS counter is reset
+# when it starts. Every span is appended to METRICS_PATH as one JSON line. All
+# scripts of one workflow run share RUN_ID, so summary() can aggregate spans written
+# by batch worker processes too.
+
+METRICS_PATH = os.path.join("output", "metrics.jsonl")
+RUN_ID = os.environ.setdefault("PIPELINE_RUN_ID", uuid.uuid4().hex[:12])
+SCRIPT = os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else "python"
+
+_current = contextvars.ContextVar("instrumentation_span", default=None)
+_write_lock = threading.Lock()
+_counter_lock = threading.Lock()
+
+FFMPEG_STATS_RE = re.compile(r"frame=\s*(\d+)\s+fps=\s*([\d.]+).*?speed=\s*([\d.]+)x")
+
+
+def _peak_rss_mb(who):
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)  # ru_maxrss is in KB on Linux
+
+
+# Reset the kernel's peak RSS counter of this process (VmHWM, Linux only).
+# ru_maxrss is not reset by this.
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+# Peak RSS of this process since the last reset_peak_rss (VmHWM), in MB; ru_maxrss
+# (the peak of the whole process lifetime) where /proc is not available
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return _peak_rss_mb(resource.RUSAGE_SELF)
+
+
+def _emit(record):
+    os.makedirs(os.path.dirname(METRICS_PATH) or ".", exist_ok=True)
+    line = json.dumps(record, ensure_ascii=False)
+    with _write_lock:
+        with open(METRICS_PATH, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+@contextmanager
+def span(name, **attrs):
+    parent = _current.get()
+    record = {
+        "type": "span",
+        "run_id": RUN_ID,
+        "script": SCRIPT,
+        "pid": os.getpid(),
+        "span": name,
+        "parent": parent["span"] if parent else None,
+        "start": round(time.time(), 3),
+        **attrs,
+        "counters": {},
+    }
+    token = _current.set(record)
+    if parent is None:
+        reset_peak_rss()
+    wall_start = time.perf_counter()
+    thread_cpu_start = time.thread_time()
+    cpu_start = time.process_time()
+    children_start = os.times()
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = repr(e)
+        raise
+    finally:
+        children_end = os.times()
+        record["wall_s"] = round(time.perf_counter() - wall_start, 4)
+        record["thread_cpu_s"] = round(time.thread_time() - thread_cpu_start, 4)
+        record["process_cpu_s"] = round(time.process_time() - cpu_start, 4)
+        record["process_children_cpu_s"] = round(
+            (children_end.children_user - children_start.children_user)
+            + (children_end.children_system - children_start.children_system), 4)
+        record["process_peak_rss_mb"] = peak_rss_mb()  # Since the top-level span started
+        record["process_children_peak_rss_mb"] = _peak_rss_mb(resource.RUSAGE_CHILDREN)  # Largest child so far
+        _current.reset(token)
+        _emit(record)
+
+
+# Add to a counter of the innermost open span (no-op outside spans)
+def count(name, value=1):
+    record = _current.get()
+    if record is None:
+        return
+    with _counter_lock:
+        record["counters"][name] = record["counters"].get(name, 0) + value
+
+
+# Attach extra fields to the innermost open span
+def annotate(**fields):
+    record = _current.get()
+    if record is not None:
+        record.update(fields)
+
+
+# Pull the final "frame= fps= speed=" progress line out of ffmpeg's stderr. frame=
+# counts the first output, but with several outputs time= and speed= follow whichever
+# finished last (a one-frame poster reads as ~0.01x), so given the wall time of the
+# run and the output frame rate, fps and speed are computed from the frame count.
+def parse_ffmpeg_stats(stderr, wall_s=None, output_fps=None):
+    if isinstance(stderr, bytes):
+        stderr = stderr.decode("utf-8", "replace")
+    matches = FFMPEG_STATS_RE.findall(stderr or "")
+    if not matches:
+        return None
+    frames, fps, speed = matches[-1]
+    frames = int(frames)
+    if wall_s and output_fps:
+        return {"frames": frames, "fps": round(frames / wall_s, 2), "speed": round(frames / output_fps / wall_s, 3)}
+    return {"frames": frames, "fps": float(fps), "speed": float(speed)}
+
+
+# Aggregate every span of this run (all scripts and worker processes) by name,
+# append it as a "summary" record and return it
+def summary():
+    spans = []
+    try:
+        with open(METRICS_PATH, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("run_id") == RUN_ID and record.get("type") == "span":
+                    spans.append(record)
+    except FileNotFoundError:
+        pass
+
+    # Process CPU and peak RSS are only attributed to top-level spans; nested stages
+    # report wall time, the CPU of their own thread and counters
+    stages = {}
+    for record in spans:
+        if "thread_cpu_s" not in record:
+            continue  # Written before the process_* fields existed
+        stage = stages.setdefault(record["span"], {
+            "count": 0, "errors": 0, "wall_s": 0.0, "max_wall_s": 0.0, "thread_cpu_s": 0.0, "counters": {},
+        })
+        stage["count"] += 1
+        stage["errors"] += 1 if "error" in record else 0
+        stage["wall_s"] = round(stage["wall_s"] + record["wall_s"], 4)
+        stage["max_wall_s"] = max(stage["max_wall_s"], record["wall_s"])
+        stage["thread_cpu_s"] = round(stage["thread_cpu_s"] + record["thread_cpu_s"], 4)
+        if record["parent"] is None:
+            stage["process_cpu_s"] = round(stage.get("process_cpu_s", 0.0) + record["process_cpu_s"], 4)
+            stage["process_children_cpu_s"] = round(
+                stage.get("process_children_cpu_s", 0.0) + record["process_children_cpu_s"], 4)
+            stage["process_peak_rss_mb"] = max(stage.get("process_peak_rss_mb", 0.0), record["process_peak_rss_mb"])
+            stage["process_children_peak_rss_mb"] = max(stage.get("process_children_peak_rss_mb", 0.0),
+                                                        record["process_children_peak_rss_mb"])
+        for key, value in record["counters"].items():
+            stage["counters"][key] = stage["counters"].get(key, 0) + value
+
+    result = {"type": "summary", "run_id": RUN_ID, "script": SCRIPT, "created": round(time.time(), 3), "stages": stages}
+    _emit(result)
+    return result
+
+
+def print_summary(result):
+    print(f"\nRun summary ({result['run_id']}):")
+    for name, stage in sorted(result["stages"].items(), key=lambda item: -item[1]["wall_s"]):
+        counters = ", ".join(f"{key}={value}" for key, value in sorted(stage["counters"].items()))
+        process = ""
+        if "process_cpu_s" in stage:
+            process = (f"  process cpu {stage['process_cpu_s']:7.2f}s  ffmpeg/child cpu {stage['process_children_cpu_s']:7.2f}s"
+                       f"  peak {stage['process_peak_rss_mb']:7.1f} MB (child {stage['process_children_peak_rss_mb']:.1f} MB)")
+        print(f"  {name:<12} x{stage['count']:<3} wall {stage['wall_s']:8.2f}s  thread cpu {stage['thread_cpu_s']:7.2f}s"
+              + process + (f"  {counters}" if counters else ""))
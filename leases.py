@@ -0,0 +1,176 @@
+import os
+import time
+import uuid
+import socket
+import threading
+from contextlib import contextmanager
+import sheets
+import instrumentation
+
+# Row claiming so several runners can work the same sheet. A runner claims a row by
+# reading CLAIM_COLUMN, and only if it holds no live claim of another runner, writing
+# "<worker id>@<expiry epoch>", waiting SETTLE_SECONDS and reading the cell back: the
+# Sheets API has no compare-and-swap, so of runners that found the row free at the
+# same time the last writer wins and the others see its claim on read-back and back off. While
+# a row renders, a heartbeat thread pushes the expiry forward; a claim that is not
+# renewed expires after LEASE_SECONDS and the row becomes free again. Publishing
+# (update_sheet.py) writes column H and clears the claim in the same batch.
+# Expiry times are compared across hosts, so runner clocks must be NTP-synced.
+
+CLAIM_COLUMN = sheets.CLAIM_COLUMN
+CLAIM_INDEX = sheets.column_index(CLAIM_COLUMN)
+LEASE_SECONDS = 15 * 60  # A claim that is not renewed frees the row after this
+HANDOFF_LEASE_SECONDS = 60 * 60  # Rendered rows stay claimed this long, waiting for update_sheet.py
+HEARTBEAT_SECONDS = 60
+SETTLE_SECONDS = 2.0  # Wait between writing a claim and reading it back
+
+_worker_id = None
+
+
+# Identifies this process in claims: host, pid and a random suffix
+def default_worker_id():
+    global _worker_id
+    if _worker_id is None:
+        _worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    return _worker_id
+
+
+def format_claim(worker, expires):
+    return f"{worker}@{int(expires)}"
+
+
+# (worker, expires) of a claim cell, or None for an empty or malformed cell
+def parse_claim(value):
+    worker, _, expires = (value or "").strip().rpartition("@")
+    if not worker:
+        return None
+    try:
+        return worker, float(expires)
+    except ValueError:
+        return None
+
+
+# True if the cell is empty or holds a claim; anything else is data that is not ours
+# to overwrite
+def is_claim_cell(value):
+    return not (value or "").strip() or parse_claim(value) is not None
+
+
+# Worker named in the cell, expired or not
+def claim_owner(value):
+    claim = parse_claim(value)
+    return claim[0] if claim else None
+
+
+# Worker holding an unexpired claim in the cell, or None
+def active_owner(value, now=None):
+    claim = parse_claim(value)
+    if claim and claim[1] > (now or time.time()):
+        return claim[0]
+    return None
+
+
+class LeaseManager:
+    def __init__(self, sheet_access, worker=None, lease_seconds=LEASE_SECONDS, settle_seconds=SETTLE_SECONDS):
+        self.sheet_access = sheet_access
+        self.worker = worker or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.settle_seconds = settle_seconds
+        self.held = {}  # (worksheet, row) -> expiry
+        self._lock = threading.Lock()  # The heartbeat thread shares sheet_access
+
+    def _read(self, keys):
+        rows_by_worksheet = {}
+        for worksheet, row in keys:
+            rows_by_worksheet.setdefault(worksheet, []).append(row)
+        cells = self.sheet_access.fetch_cells(rows_by_worksheet, columns=(CLAIM_COLUMN,))
+        return {key: cells[key][CLAIM_INDEX] if key in cells else '' for key in keys}
+
+    def _write(self, values):
+        self.sheet_access.write_cells([(worksheet, row, CLAIM_INDEX + 1, value)
+                                       for (worksheet, row), value in values.items()])
+
+    # True if the cell is empty or holds no live claim of another worker
+    def is_free(self, value, now=None):
+        if not is_claim_cell(value):
+            return False
+        owner = active_owner(value, now)
+        return owner is None or owner == self.worker
+
+    # Read, write, verify claim of one row: a row with a live claim of another worker
+    # is left alone, otherwise the claim is written and read back. Returns True if this
+    # worker now holds it.
+    def claim(self, worksheet, row):
+        key = (worksheet, row)
+        with self._lock:
+            won = self.is_free(self._read([key])[key])
+            if won:
+                expires = time.time() + self.lease_seconds
+                value = format_claim(self.worker, expires)
+                self._write({key: value})
+                time.sleep(self.settle_seconds)
+                won = self._read([key])[key] == value
+            if won:
+                self.held[key] = expires
+        instrumentation.count("rows_claimed" if won else "claims_lost")
+        return won
+
+    # Extend held claims (default: all) by lease_seconds from now. Claims overwritten
+    # by another worker (or cleared) are dropped from held and returned.
+    def renew(self, keys=None, lease_seconds=None):
+        with self._lock:
+            keys = [key for key in (keys if keys is not None else list(self.held)) if key in self.held]
+            if not keys:
+                return []
+            current = self._read(keys)
+            lost = [key for key in keys if claim_owner(current[key]) != self.worker]
+            for key in lost:
+                del self.held[key]
+            expires = time.time() + (lease_seconds or self.lease_seconds)
+            kept = {key: format_claim(self.worker, expires) for key in keys if key not in lost}
+            if kept:
+                self._write(kept)
+                for key in kept:
+                    self.held[key] = expires
+        for worksheet, row in lost:
+            print(f"  Warning: Lost the claim on row {row} in worksheet '{worksheet}' to another runner")
+        return lost
+
+    # Clear claims this worker still holds (default: all)
+    def release(self, keys=None):
+        with self._lock:
+            keys = [key for key in (keys if keys is not None else list(self.held)) if key in self.held]
+            if not keys:
+                return
+            current = self._read(keys)
+            mine = {key: '' for key in keys if claim_owner(current[key]) == self.worker}
+            if mine:
+                self._write(mine)
+            for key in keys:
+                del self.held[key]
+
+    # Stop tracking claims without touching the cells (handed over to the publish step)
+    def detach(self, keys):
+        with self._lock:
+            for key in keys:
+                self.held.pop(key, None)
+
+    # Renew all held claims every interval seconds while the block runs
+    @contextmanager
+    def heartbeat(self, interval=HEARTBEAT_SECONDS):
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                try:
+                    self.renew()
+                except Exception as e:
+                    print(f"  Warning: Claim heartbeat failed: {e}")
+
+        thread = threading.Thread(target=beat, name="lease-heartbeat", daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            thread.join()
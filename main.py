@@ -1,17 +1,31 @@
 import os
 import re
+import json
+import shutil
+import time
+import signal
+import argparse
 import requests
+import threading
 import subprocess
-import textwrap
-from PIL import Image, ImageDraw, ImageFont
-from moviepy.editor import ImageClip, concatenate_videoclips, AudioFileClip
-import numpy as np
-import glob
-from google.cloud import texttospeech
-import gspread
-from google.oauth2.service_account import Credentials
+from io import BytesIO
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
 import random
 import unicodedata
+import tts
+import sheets
+import stage_scheduler
+import instrumentation
+import encode_budget
+import captions
+import manifest
+import leases
+import update_sheet
+
+# moviepy, PIL, numpy and the modules built on them (ffmpeg_render, title_layout,
+# image_pipeline, image_cache) are imported by the functions that use them, so a run
+# that finds no pending rows only pays for gspread.
 
 # Configuration options (modify these as needed)
 NUM_VIDEOS_TO_CREATE = 1  # Number of videos to create per run
@@ -21,9 +35,42 @@ WORKSHEET_LIST = [
     "Sheet3",
     # Add more sheet names here
 ]
+RENDER_BACKEND = "moviepy"  # "moviepy" (per-frame Python), "ffmpeg" (single ffmpeg filtergraph) or "stream" (bounded-memory frames piped to ffmpeg)
+BATCH_MODE = False  # Collect NUM_VIDEOS_TO_CREATE pending rows across all worksheets and render them in parallel
+BATCH_WORKERS = os.cpu_count() or 1  # Number of worker processes in batch mode (one per core)
+TTS_CACHE_DIR = os.path.join("cache", "tts")  # On-disk cache of synthesized audio
+TTS_CACHE_MAX_BYTES = 200 * 1024 * 1024  # Least recently used audio is evicted above this size
+IMAGE_CACHE_DIR = os.path.join("cache", "images")  # Normalized frames by cover URL and crawl keyword
+IMAGE_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+IMAGE_CACHE_TTL = 14 * 24 * 60 * 60  # Seconds before a cached cover or crawl result is fetched again
+CRAWL_TIME_BUDGET = 45  # Seconds before the image crawl is cancelled with the images it has
+STAGE_TIMEOUTS = {  # Seconds before a stage is abandoned (audio fails the row, the others fall back)
+    "audio": 180,
+    "title": 30,
+    "images": 120,
+}
+WORKER_POLL_SECONDS = 60  # --worker: poll interval while rows keep coming in
+WORKER_MAX_POLL_SECONDS = 15 * 60  # --worker: idle polls back off up to this interval
+WORKER_RETRY_SECONDS = 60 * 60  # --worker: a row already rendered or failed is not picked up again before this
+MAX_AUDIO_SECONDS = 55  # Text beyond this is not synthesized; the audio is cut here when muxed
+ENCODE_MODE = "vbv"  # "fixed" (700k, size not guaranteed), "vbv" (capped single pass) or "two_pass" (ffmpeg and stream backends)
+TARGET_SIZE_MB = encode_budget.TARGET_SIZE_MB  # Delivery limit the video bitrate is derived from
+ENCODER_PROFILE = None  # (codec, preset) to force, e.g. ("libx265", "medium"); None uses the host calibration (encoder_calibration.py)
+CAPTIONS = True  # Burn sentence captions, timed from the TTS chunks, into the video (see captions.py)
+OUTPUT_PROFILES = [  # Extra renditions encoded from the same composite as the delivery video (see ffmpeg_render.OutputProfile)
+    {"name": "preview", "width": 360, "height": 640, "codec": "libx264", "bitrate": "300k", "preset": "veryfast"},
+    {"name": "poster", "still_at": 1.0},
+]
+
+SCAN_STATE_PATH = os.path.join("cache", "scan_state.json")  # Per-worksheet scan cursor (see sheets.ScanCursor)
+SCAN_FULL_INTERVAL = 24 * 60 * 60  # Seconds between full scans that ignore the cursor
+SCAN_IDLE_EXIT_CODE = 3  # --scan exit code when no row is pending
 
-# Fallback for ANTIALIAS in Pillow
-Image.ANTIALIAS = Image.LANCZOS
+output_dir = "output"
+jobs_dir = os.path.join(output_dir, "jobs")  # Per-row scratch directories
+WORKER_STATUS_PATH = os.path.join(output_dir, "worker_status.json")
+MANIFEST_PATH = manifest.MANIFEST_PATH  # Append-only lifecycle record of every video
+renditions_dir = os.path.join(output_dir, "renditions")  # OUTPUT_PROFILES outputs; not committed
 
 # Check for ffmpeg
 def check_ffmpeg():
@@ -52,384 +99,824 @@ def clean_filename(text, max_length=50):
         text = f"video_{random.randint(1000, 9999)}"
     return text.lower()
 
-# Directory setup
-output_dir = "output"
-print("Stage 1: Creating output directory...")
-os.makedirs(output_dir, exist_ok=True)
-print(f"  Created directory: {output_dir}")
-
-# Google Sheets setup
-print("Stage 0: Initializing Google Sheets...")
-scopes = ['https://www.googleapis.com/auth/spreadsheets']
-creds = Credentials.from_service_account_file('google_sheets_key.json', scopes=scopes)
-gc = gspread.authorize(creds)
-SHEET_ID = '14tqKftTqlesnb0NqJZU-_f1EsWWywYqO36NiuDdmaTo'
-
-# Counter for created videos
-videos_created = 0
-
-# Process up to NUM_VIDEOS_TO_CREATE videos
-for worksheet_name in WORKSHEET_LIST:
-    if videos_created >= NUM_VIDEOS_TO_CREATE:
-        break
-    print(f"\nChecking worksheet: {worksheet_name}")
+# Extract title, content and cover image URL from a sheet row
+def parse_row(row):
+    raw_content = row[1] if len(row) > 1 else ''
+    raw_content = re.sub(r'\*+', '', raw_content)  # Remove asterisks
+    raw_content = re.sub(r'[\U0001F600-\U0001F64F\U0001F300-\U0001F5FF\U0001F680-\U0001F6FF\U0001F1E0-\U0001F1FF\U00002702-\U000027B0\U000024C2-\U0001F251]+', '', raw_content)  # Remove emojis
+    raw_content = re.sub(r'#\w+\s*', '', raw_content)  # Remove hashtags
+    lines = [line.strip() for line in raw_content.split('\n') if line.strip()]
+    title_text = lines[0].replace('Tiêu đề:', '').strip() if lines else 'Untitled'
+    content_text = '\n'.join(lines[1:]) if len(lines) > 1 else title_text
+
+    # Extract cover image URL from column D (index 3)
+    bg_image_url = row[3] if len(row) > 3 else 'https://via.placeholder.com/1080x1920?text=No+Image'
+    return title_text, content_text, bg_image_url
+
+_tts_cache = None
+
+# One TTS cache per process (shared on disk between batch workers)
+def get_tts_cache():
+    global _tts_cache
+    if _tts_cache is None:
+        _tts_cache = tts.TTSCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES)
+    return _tts_cache
+
+_http_session = None
+
+# Pooled HTTP session shared by the stages of every row in this process
+def get_http_session():
+    global _http_session
+    if _http_session is None:
+        _http_session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=2)
+        _http_session.mount("http://", adapter)
+        _http_session.mount("https://", adapter)
+    return _http_session
+
+_image_cache = None
+
+# One image cache per process (shared on disk between batch workers)
+def get_image_cache():
+    global _image_cache
+    if _image_cache is None:
+        import image_cache
+        _image_cache = image_cache.ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES, IMAGE_CACHE_TTL)
+    return _image_cache
+
+_encoder_profile = None
+
+# Video (codec, preset) for this process: ENCODER_PROFILE, or the fastest candidate of
+# the host calibration that meets the quality target (calibrating first if needed)
+def get_encoder_profile(force_calibration=False):
+    global _encoder_profile
+    if _encoder_profile is None or force_calibration:
+        if ENCODER_PROFILE and not force_calibration:
+            _encoder_profile = tuple(ENCODER_PROFILE)
+            print(f"Encoder: {_encoder_profile[0]} {_encoder_profile[1]} (configured)")
+            return _encoder_profile
+        import encoder_calibration
+        try:
+            codec, preset, result = encoder_calibration.host_profile(force=force_calibration, max_seconds=MAX_AUDIO_SECONDS, target_mb=TARGET_SIZE_MB)
+        except Exception as e:
+            print(f"  Warning: Encoder calibration failed: {e}")
+            codec, preset, result = encoder_calibration.DEFAULT_PROFILE + (None,)
+        _encoder_profile = (codec, preset)
+        if result:
+            print(f"Encoder: {codec} {preset} (calibrated: {result['speed']:.2f}x realtime, {result['kbps']:.0f} kbps, SSIM {result['ssim']:.4f})")
+        else:
+            print(f"Encoder: {codec} {preset} (default; no calibrated candidate met the target)")
+    return _encoder_profile
+
+# Stage 2: Create audio with Google Cloud TTS
+# LINEAR16 chunks are joined into one WAV; the only lossy encode is the AAC in the final mux
+def create_audio(content_text, audio_path, client=None):
+    print("Stage 2: Creating audio with Google Cloud TTS...")
+    cache = get_tts_cache()
+    chunk_texts = tts.plan_chunks(content_text, speaking_rate=1.25, max_seconds=MAX_AUDIO_SECONDS)
+    chunks = tts.synthesize_chunks(
+        chunk_texts,
+        client=client,
+        cache=cache,
+        language_code="vi-VN",
+        voice_name="vi-VN-Wavenet-C",  # Changed from vi-VN-Wavenet-A to vi-VN-Wavenet-C
+        speaking_rate=1.25,
+        pitch=0.0,
+        encoding="LINEAR16",
+        sample_rate=24000  # Native Wavenet rate
+    )
+    print(f"  Synthesized {len(chunks)} chunk(s) within the {MAX_AUDIO_SECONDS}s budget")
+    tts.join_wav(chunks, audio_path)
+    instrumentation.count("bytes_written", os.path.getsize(audio_path))
+    if CAPTIONS:
+        try:
+            cues = captions.build_cues(chunk_texts, [tts.audio_content_duration(chunk) for chunk in chunks], MAX_AUDIO_SECONDS)
+            captions.write_ass(cues, captions.captions_path(audio_path))
+            print(f"  Wrote {len(cues)} caption cue(s)")
+        except Exception as e:
+            print(f"  Warning: Failed to write captions: {e}")
+    stats = cache.stats()
+    print(f"  TTS cache: {stats['hits']} hit(s), {stats['misses']} miss(es)")
+    print(f"  Saved audio at: {audio_path} ({tts.wav_duration(audio_path):.1f}s)")
+
+# Stage 3: Create title image
+def create_title_image(title, bg_image_url, output_path):
+    print("Stage 3: Creating title image...")
+    from PIL import Image, ImageDraw
+    import numpy as np
+    import image_pipeline
+    import title_layout
+    target_size = (720, 1280)
+    cache = get_image_cache()
     try:
-        worksheet = gc.open_by_key(SHEET_ID).worksheet(worksheet_name)
-    except gspread.exceptions.WorksheetNotFound:
-        print(f"  Error: Worksheet '{worksheet_name}' not found. Skipping.")
-        continue
-
-    # Read rows from the worksheet
-    rows = worksheet.get_all_values()
-    for i, row in enumerate(rows):
-        if videos_created >= NUM_VIDEOS_TO_CREATE:
-            break
-        if i == 0:  # Skip header
+        if bg_image_url is None:
+            raise ValueError("no cover image")
+        cover_frame = cache.get_cover(bg_image_url)
+        if cover_frame is not None:
+            final_image = Image.fromarray(cover_frame)
+            print("  Using cached background image.")
+        else:
+            response = get_http_session().get(bg_image_url, timeout=10)
+            response.raise_for_status()
+            instrumentation.count("bytes_downloaded", len(response.content))
+            final_image = image_pipeline.normalize_image(BytesIO(response.content), target_size)
+            cache.put_cover(bg_image_url, np.asarray(final_image))
+            print("  Downloaded background image.")
+    except Exception as e:
+        print(f"  Warning: Failed to download background image: {e}. Using black background.")
+        final_image = Image.new("RGB", target_size, (0, 0, 0))
+
+    layout = title_layout.fit_title(title)
+    if not layout:
+        print("  Error: No custom font found. Default font is not suitable for the title card. Please install a font like Arial or Roboto.")
+        return
+    print(f"  Using font: {layout.font_path}")
+    print(f"  Final font_size: {layout.font_size}, wrap_width: {layout.wrap_width}, max_text_width: {layout.max_text_width}, total_height: {layout.total_height}, lines: {len(layout.lines)}")
+
+    text_area_height = layout.total_height + 40
+    text_area = Image.new("RGBA", (720, text_area_height), (0, 0, 0, int(255 * 0.7)))
+    text_draw = ImageDraw.Draw(text_area)
+
+    current_y = 20
+    for line, text_bbox in zip(layout.lines, layout.line_boxes):
+        text_width = text_bbox[2] - text_bbox[0]
+        text_x = (720 - text_width) // 2 - text_bbox[0]
+        text_draw.text((text_x, current_y), line, font=layout.font, fill=(255, 255, 255), stroke_width=2, stroke_fill=(0, 0, 0))
+        current_y += layout.line_height + title_layout.LINE_SPACING
+
+    text_y = (1280 - text_area_height) // 2
+    final_image = final_image.convert("RGBA")
+    final_image.paste(text_area, (0, text_y), text_area)
+    final_image = final_image.convert("RGB")
+
+    final_image.save(output_path)
+    instrumentation.count("bytes_written", os.path.getsize(output_path))
+    print(f"  Saved title image at: {output_path}")
+
+# Stage 4: Download images
+# Returns normalized frames, or with as_paths the paths of their .npy files in the image cache
+def download_images_with_icrawler(keyword, num_images, work_dir, fallback_image, as_paths=False):
+    print("Stage 4: Attempting to download images...")
+    cache = get_image_cache()
+    cached_frames = cache.get_keyword_paths(keyword) if as_paths else cache.get_keyword(keyword)
+    if cached_frames and len(cached_frames) >= 2:
+        print(f"  Using {len(cached_frames)} cached images for keyword: {keyword}")
+        return cached_frames[:num_images]
+
+    keyword_clean = clean_filename(keyword)  # Clean keyword for directory
+    keyword_dir = os.path.join(work_dir, keyword_clean)
+    os.makedirs(keyword_dir, exist_ok=True)
+
+    try:
+        import image_crawl
+        # Screened and decoded straight to 720x1280 frames while the crawl runs; the
+        # render stage takes the arrays as they are
+        frames = image_crawl.crawl_frames(keyword, num_images, keyword_dir, min_size=(500, 500), time_budget=CRAWL_TIME_BUDGET)
+        print(f"  Crawled {len(frames)} images for keyword: {keyword}")
+    except ImportError:
+        print("  Warning: icrawler not installed. Using fallback images.")
+        return [fallback_image] * max(2, num_images)
+    except Exception as e:
+        print(f"  Warning: Image crawling failed: {e}. Using fallback images.")
+        return [fallback_image] * max(2, num_images)
+
+    if len(frames) < 2:
+        print("  Warning: Not enough images downloaded. Using fallback.")
+        return [fallback_image] * max(2, num_images)
+
+    paths = cache.put_keyword(keyword, frames)
+    return paths if as_paths else frames
+
+# Stage 5: Create video with varied transitions
+def create_video(image_paths, audio_path, output_path, row_label):
+    print("Stage 5: Creating video...")
+    import ffmpeg_render
+    import image_pipeline
+    try:
+        # From the WAV header; longer audio is cut at MAX_AUDIO_SECONDS in the mux
+        audio_duration = min(tts.wav_duration(audio_path), MAX_AUDIO_SECONDS)
+    except Exception as e:
+        print(f"  Error loading audio {audio_path}: {e}. Skipping row {row_label}.")
+        return False
+
+    clips = []
+    num_images = len(image_paths)
+    title_duration = audio_duration * 1.2 / num_images
+    other_duration = (audio_duration - title_duration) / (num_images - 1) if num_images > 1 else audio_duration
+
+    def zoom_in(t, duration):
+        return 1 + 0.2 * (t / duration)
+
+    def zoom_out(t, duration):
+        return 1.2 - 0.2 * (t / duration)
+
+    def pan_left(t, duration):
+        return (0.2 * (t / duration) * 720, 'center')
+
+    def pan_right(t, duration):
+        return (-0.2 * (t / duration) * 720, 'center')
+
+    def pan_up(t, duration):
+        return ('center', 0.2 * (t / duration) * 1280)
+
+    def pan_down(t, duration):
+        return ('center', -0.2 * (t / duration) * 1280)
+
+    transitions = [zoom_in, zoom_out, pan_left, pan_right, pan_up, pan_down]
+
+    # Derive the video bitrate from the size budget and the audio duration up front,
+    # so the first encode already fits
+    encode_mode = ENCODE_MODE
+    if encode_mode == "two_pass" and RENDER_BACKEND == "moviepy":
+        print("  Two-pass encoding needs the ffmpeg or stream backend; using capped VBV instead.")
+        encode_mode = "vbv"
+    try:
+        video_bitrate = encode_budget.video_bitrate(encode_mode, audio_duration, TARGET_SIZE_MB, "96k")
+    except ValueError as e:
+        print(f"  Error: {e}. Skipping row {row_label}.")
+        return False
+    codec, preset = get_encoder_profile()
+    print(f"  Encoding with {codec} {preset}, {encode_mode} rate control at {video_bitrate} video / 96k audio (budget {TARGET_SIZE_MB} MB)")
+    instrumentation.annotate(encode_mode=encode_mode, video_bitrate=video_bitrate, codec=codec, preset=preset)
+    renditions = output_renditions(output_path)
+    captions_path = captions.captions_path(audio_path)
+    if not (CAPTIONS and os.path.exists(captions_path)):
+        captions_path = None
+    if renditions:
+        os.makedirs(renditions_dir, exist_ok=True)
+
+    if RENDER_BACKEND in ("ffmpeg", "stream"):
+        if RENDER_BACKEND == "stream":
+            import stream_render as renderer
+        else:
+            renderer = ffmpeg_render
+        plan = []
+        for i, img_path in enumerate(image_paths):
+            duration = title_duration if i == 0 else other_duration
+            transition = transitions[i % len(transitions)]
+            plan.append((img_path, duration, transition.__name__))
+            print(f"  Applied transition {transition.__name__} to {image_pipeline.describe(img_path)}")
+        try:
+            stats = renderer.render_video(plan, audio_path, output_path, encode_mode=encode_mode, fps=15, codec=codec, bitrate=video_bitrate, audio_bitrate="96k", preset=preset, max_seconds=MAX_AUDIO_SECONDS, renditions=renditions, captions_path=captions_path)
+            instrumentation.annotate(ffmpeg=stats, audio_s=round(audio_duration, 2))
+            instrumentation.count("bytes_written", os.path.getsize(output_path))
+            for _, path in renditions:
+                instrumentation.count("bytes_written", os.path.getsize(path))
+            check_size_budget(output_path)
+            print(f"  Saved video at: {output_path}")
+            return True
+        except Exception as e:
+            print(f"  Error saving video: {e}. Skipping row {row_label}.")
+            return False
+
+    from PIL import Image
+    from moviepy.editor import ImageClip, concatenate_videoclips
+    Image.ANTIALIAS = Image.LANCZOS  # moviepy 1.0.3 still resizes with the removed ANTIALIAS
+
+    for i, img_path in enumerate(image_paths):
+        try:
+            duration = title_duration if i == 0 else other_duration
+            clip = ImageClip(img_path, duration=duration)
+            transition = transitions[i % len(transitions)]
+            clip = clip.resize(lambda t: transition(t, duration) if transition in [zoom_in, zoom_out] else 1.0).set_position(lambda t: transition(t, duration) if transition not in [zoom_in, zoom_out] else 'center')
+            clips.append(clip)
+            print(f"  Applied transition {transition.__name__} to {image_pipeline.describe(img_path)}")
+        except Exception as e:
+            print(f"  Warning: Failed to process image {image_pipeline.describe(img_path)}: {e}")
+            continue
+
+    if not clips:
+        print(f"  Error: No valid clips to create video for row {row_label}. Skipping.")
+        return False
+
+    # moviepy writes the video stream only; the WAV is encoded to AAC once while muxing
+    video_only_path = f"{os.path.splitext(output_path)[0]}.video.mp4"
+    try:
+        video = concatenate_videoclips(clips, method="compose")
+        encode_start = time.perf_counter()
+        # moviepy adds -b:v itself; the rest of the rate control goes in ffmpeg_params
+        ffmpeg_params = ["-preset", preset] + encode_budget.rate_control_args(codec, video_bitrate, encode_mode)
+        if captions_path:
+            ffmpeg_params += ["-vf", captions.caption_filter(captions_path)]  # Burned in by the same encode
+        video.write_videofile(video_only_path, codec=codec, audio=False, fps=15, bitrate=video_bitrate, ffmpeg_params=ffmpeg_params)
+        ffmpeg_render.mux_audio(video_only_path, audio_path, output_path, audio_bitrate="96k", max_seconds=MAX_AUDIO_SECONDS)
+        # moviepy keeps ffmpeg's own statistics to itself; report the equivalent
+        frames = int(video.duration * 15)
+        elapsed = time.perf_counter() - encode_start
+        instrumentation.annotate(ffmpeg={"frames": frames, "fps": round(frames / elapsed, 2), "speed": round(video.duration / elapsed, 3)}, audio_s=round(audio_duration, 2))
+        instrumentation.count("bytes_written", os.path.getsize(output_path))
+        check_size_budget(output_path)
+        print(f"  Saved video at: {output_path}")
+    except Exception as e:
+        print(f"  Error saving video: {e}. Skipping row {row_label}.")
+        return False
+    finally:
+        if os.path.exists(video_only_path):
+            os.remove(video_only_path)
+
+    # moviepy has no way to fan its frames out; the renditions decode the delivery video once instead
+    if renditions:
+        try:
+            ffmpeg_render.derive_renditions(output_path, renditions, fps=15)
+            for _, path in renditions:
+                instrumentation.count("bytes_written", os.path.getsize(path))
+        except Exception as e:
+            print(f"  Warning: Failed to encode renditions: {e}")
+    return True
+
+# (OutputProfile, path) for every entry of OUTPUT_PROFILES, named after the video
+def output_renditions(output_path):
+    import ffmpeg_render
+    stem = os.path.splitext(os.path.basename(output_path))[0]
+    renditions = []
+    for options in OUTPUT_PROFILES:
+        profile = ffmpeg_render.OutputProfile(**options)
+        renditions.append((profile, os.path.join(renditions_dir, f"{stem}_{profile.name}.{profile.extension}")))
+    return renditions
+
+# Report a video that still ended up over the size budget (update_sheet.py flags it)
+def check_size_budget(output_path):
+    over = encode_budget.overshoot(output_path, TARGET_SIZE_MB)
+    instrumentation.annotate(over_budget_bytes=over)
+    if over:
+        print(f"  Warning: video is {over} bytes over the {TARGET_SIZE_MB} MB budget")
+
+# Run stages 2-5 for one sheet row inside its own scratch directory.
+# Returns a dict describing the rendered video, or None if the row failed.
+def process_row(job):
+    with instrumentation.span("row", worksheet=job["worksheet"], row=job["row_num"]):
+        result = _process_row(job)
+        instrumentation.annotate(ok=result is not None)
+        return result
+
+def _process_row(job):
+    worksheet_name = job["worksheet"]
+    selected_row_num = job["row_num"]
+    work_dir = job["work_dir"]
+    print(f"  Processing row {selected_row_num} in worksheet '{worksheet_name}'...")
+    os.makedirs(work_dir, exist_ok=True)
+    graph = stage_scheduler.StageGraph(max_workers=3)
+
+    try:
+        title_text, content_text, bg_image_url = parse_row(job["row"])
+        clean_title = clean_filename(title_text)
+        print(f"  Original title: {title_text}")
+        print(f"  Clean title for filename: {clean_title}")
+        print(f"  Clean content length: {len(content_text)} chars")
+        print(f"  Cover image URL: {bg_image_url}")
+
+        audio_path = os.path.join(work_dir, "voiceover.wav")
+        title_image_path = os.path.join(work_dir, "title_image.jpg")
+        # A title stage that timed out may still be writing title_image_path
+        fallback_title_path = os.path.join(work_dir, "title_image_fallback.jpg")
+        # Titles often share their first 50 characters, so the row goes in the name too
+        output_video_path = os.path.join(output_dir, f"output_video_{clean_title}_{job['name']}.mp4")
+        keyword = title_text[:50]
+
+        def audio_stage():
+            with instrumentation.span("audio"):
+                create_audio(content_text, audio_path)
+                return audio_path
+
+        def title_stage():
+            with instrumentation.span("title"):
+                create_title_image(title_text, bg_image_url, title_image_path)
+                if not os.path.exists(title_image_path):
+                    raise RuntimeError("no title image was written")
+                return title_image_path
+
+        def title_fallback(error):
+            # Retry without the cover (black background)
+            with instrumentation.span("title", fallback=True):
+                create_title_image(title_text, None, fallback_title_path)
+                if not os.path.exists(fallback_title_path):
+                    raise RuntimeError("no title image was written")
+                return fallback_title_path
+
+        def images_stage():
+            with instrumentation.span("images"):
+                # The stream backend loads each frame when its segment comes up
+                return download_images_with_icrawler(keyword, 10, work_dir, title_image_path,
+                                                     as_paths=RENDER_BACKEND == "stream")
+
+        def render_stage(audio, title, images):
+            with instrumentation.span("render", backend=RENDER_BACKEND, images=len(images) + 1):
+                print(f"  Retrieved {len(images)} images")
+                # Fallback images stand for the title card, wherever it was written
+                images = [title if isinstance(image, str) and image == title_image_path else image for image in images]
+                return create_video([title] + images, audio, output_video_path, selected_row_num)
+
+        # TTS, cover download + title card and the image crawl run concurrently;
+        # the render starts as soon as all three are ready
+        graph.add("audio", audio_stage, timeout=STAGE_TIMEOUTS["audio"])
+        graph.add("title", title_stage, timeout=STAGE_TIMEOUTS["title"], fallback=title_fallback)
+        graph.add("images", images_stage, timeout=STAGE_TIMEOUTS["images"],
+                  fallback=lambda error: [title_image_path] * 10)
+        graph.add("render", render_stage, deps=("audio", "title", "images"))
+        results, errors = graph.run()
+
+        if "audio" in errors:
+            print(f"  Error creating audio: {errors['audio']}. Skipping row {selected_row_num}.")
+            return None
+        if "title" in errors:
+            print(f"  Error: Failed to create title image for row {selected_row_num}. Skipping.")
+            return None
+        if not results.get("render"):
+            print(f"Failed to create video for row {selected_row_num} in worksheet '{worksheet_name}'.")
+            return None
+
+        print(f"Video created successfully at: {output_video_path}")
+        print(f"Video size: {os.path.getsize(output_video_path) / (1024 * 1024):.2f} MB")
+        return {
+            "worksheet": worksheet_name,
+            "row": selected_row_num,
+            "clean_title": clean_title,
+            "video_path": output_video_path,
+            "duration": min(tts.wav_duration(audio_path), MAX_AUDIO_SECONDS),
+            "renditions": [path for _, path in output_renditions(output_video_path) if os.path.exists(path)],
+        }
+    finally:
+        # Clean up temporary files (except video), once stages abandoned on timeout
+        # have stopped writing to them
+        def clean_up():
+            shutil.rmtree(work_dir, ignore_errors=True)
+            print("Cleanup complete.")
+
+        print("Cleaning up temporary files...")
+        graph.after_abandoned(clean_up)
+
+# Yield a job for every row with an empty column H, worksheet by worksheet.
+# Columns B, D, H and I of all worksheets are fetched in a single request; with a
+# cursor, only from the first row that was still pending on the previous scan.
+def iter_pending_rows(sheet_access, cursor=None):
+    first_rows = cursor.first_rows() if cursor else {}
+    with instrumentation.span("scan", worksheets=len(WORKSHEET_LIST), full=not first_rows):
+        try:
+            worksheet_rows = sheet_access.fetch_rows(WORKSHEET_LIST, first_rows=first_rows)
+        except Exception as e:
+            if not first_rows:
+                raise
+            # e.g. rows deleted below the cursor, so its range is outside the grid
+            print(f"  Warning: Scan from the saved cursor failed ({e}). Rescanning all rows.")
+            first_rows = {}
+            cursor.force_full_scan()
+            worksheet_rows = sheet_access.fetch_rows(WORKSHEET_LIST)
+
+    pending = {}
+    for worksheet_name, rows in worksheet_rows.items():
+        first_row = first_rows.get(worksheet_name, 2)  # Header is row 1
+        pending[worksheet_name] = [
+            (first_row + i, row) for i, row in enumerate(rows)
+            if not row[7] or row[7].strip() == ''
+        ]
+        if cursor:
+            # First pending row, else the last row read (a range past the grid is an API error)
+            last_row = first_row + max(len(rows) - 1, 0)
+            cursor.update(worksheet_name, pending[worksheet_name][0][0] if pending[worksheet_name] else last_row)
+    if cursor:
+        cursor.save()
+
+    for worksheet_name in WORKSHEET_LIST:
+        print(f"\nChecking worksheet: {worksheet_name}")
+        if worksheet_name not in pending:
+            print(f"  Error: Worksheet '{worksheet_name}' not found. Skipping.")
+            continue
+        for row_num, row in pending[worksheet_name]:
+            if not leases.is_claim_cell(row[leases.CLAIM_INDEX]):
+                print(f"  Row {row_num} has data in claim column {leases.CLAIM_COLUMN}. Skipping.")
+                continue
+            owner = leases.active_owner(row[leases.CLAIM_INDEX])
+            if owner:
+                print(f"  Row {row_num} is claimed by {owner}. Skipping.")
+                continue
+            job_name = f"{clean_filename(worksheet_name)}_row{row_num}"  # Unique per row
+            yield {
+                "worksheet": worksheet_name,
+                "row_num": row_num,
+                "row": row,
+                "name": job_name,
+                "work_dir": os.path.join(jobs_dir, job_name),
+            }
+
+def get_scan_cursor():
+    return sheets.ScanCursor(SCAN_STATE_PATH, SCAN_FULL_INTERVAL)
+
+# Count pending rows without loading the render stack (--scan)
+def scan():
+    with instrumentation.span("run", scan_only=True):
+        sheet_access = sheets.SheetAccess(sheets.open_spreadsheet())
+        pending = sum(1 for _ in iter_pending_rows(sheet_access, get_scan_cursor()))
+        instrumentation.annotate(pending_rows=pending)
+    print(f"{pending} pending row(s)")
+    return pending
+
+# Claim each job right before it is rendered; rows another runner won are skipped
+def claim_jobs(jobs, lease_manager):
+    for job in jobs:
+        if lease_manager.claim(job["worksheet"], job["row_num"]):
+            yield job
+        else:
+            print(f"  Row {job['row_num']} in worksheet '{job['worksheet']}' was claimed by another runner. Skipping.")
+
+# Keep the claims of rendered rows for update_sheet.py and release the rest. A row
+# whose claim was lost meanwhile belongs to another runner, so its video is dropped.
+def hand_off(results, lease_manager):
+    rendered = [(result["worksheet"], result["row"]) for result in results]
+    lost = lease_manager.renew(rendered, leases.HANDOFF_LEASE_SECONDS)
+    lease_manager.detach(rendered)
+    lease_manager.release()
+    kept = []
+    for result in results:
+        if (result["worksheet"], result["row"]) in lost:
+            print(f"  Dropping {result['video_path']}: row {result['row']} now belongs to another runner")
+            os.remove(result["video_path"])
             continue
-        if len(row) > 7 and (not row[7] or row[7].strip() == ''):
-            print(f"  Processing row {i + 1} in worksheet '{worksheet_name}'...")
-            selected_row = row
-            selected_row_num = i + 1  # 1-based index
-
-            # Extract and clean title for filename
-            raw_content = selected_row[1] if len(selected_row) > 1 else ''
-            raw_content = re.sub(r'\*+', '', raw_content)  # Remove asterisks
-            raw_content = re.sub(r'[\U0001F600-\U0001F64F\U0001F300-\U0001F5FF\U0001F680-\U0001F6FF\U0001F1E0-\U0001F1FF\U00002702-\U000027B0\U000024C2-\U0001F251]+', '', raw_content)  # Remove emojis
-            raw_content = re.sub(r'#\w+\s*', '', raw_content)  # Remove hashtags
-            lines = [line.strip() for line in raw_content.split('\n') if line.strip()]
-            title_text = lines[0].replace('Tiêu đề:', '').strip() if lines else 'Untitled'
-            content_text = '\n'.join(lines[1:]) if len(lines) > 1 else title_text
-
-            clean_title = clean_filename(title_text)
-            print(f"  Original title: {title_text}")
-            print(f"  Clean title for filename: {clean_title}")
-            print(f"  Clean content length: {len(content_text)} chars")
-
-            # Save clean_title for update_sheet.py
-            with open(os.path.join(output_dir, "clean_title.txt"), "w") as f:
-                f.write(clean_title)
-
-            # Extract cover image URL from column D (index 3)
-            bg_image_url = selected_row[3] if len(selected_row) > 3 else 'https://via.placeholder.com/1080x1920?text=No+Image'
-            print(f"  Cover image URL: {bg_image_url}")
-
-            # Stage 2: Create audio with Google Cloud TTS
-            print("Stage 2: Creating audio with Google Cloud TTS...")
+        kept.append(dict(result, claimed_by=lease_manager.worker))
+    return kept
+
+# Record the new videos in the artifact manifest (see manifest.py)
+def record_artifacts(results):
+    artifacts = manifest.Manifest(MANIFEST_PATH)
+    for result in results:
+        artifacts.record_created(result["video_path"], worksheet=result["worksheet"], row=result["row"],
+                                 duration=result["duration"], clean_title=result["clean_title"])
+
+# Hand the rendered rows over to update_sheet.py. append keeps the rows already in the
+# file (a worker's earlier rows that are still unpublished).
+def save_rendered_rows(results, append=False):
+    path = os.path.join(output_dir, "rendered_rows.json")
+    if append and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            earlier = json.load(f)
+        keys = {(result["worksheet"], result["row"]) for result in results}
+        results = [entry for entry in earlier if (entry["worksheet"], entry["row"]) not in keys] + results
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    # Kept for the workflow steps that read a single title
+    with open(os.path.join(output_dir, "clean_title.txt"), "w") as f:
+        f.write(results[-1]["clean_title"])
+
+# Render pending jobs until NUM_VIDEOS_TO_CREATE videos exist. Rows run one at a time,
+# or NUM_VIDEOS_TO_CREATE at once on a batch process pool. stop (a threading.Event)
+# ends a sequential run between rows. Each video is appended to results as its row
+# finishes, so a caller passing its own list keeps them if a later row raises.
+def render_rows(pending, pool=None, stop=None, results=None):
+    results = [] if results is None else results
+    if pool is not None:
+        jobs = list(islice(pending, NUM_VIDEOS_TO_CREATE))
+        if not jobs:
+            return results
+        print(f"\nBatch mode: rendering {len(jobs)} row(s) with {min(BATCH_WORKERS, len(jobs))} worker(s)")
+        futures = [pool.submit(process_row, job) for job in jobs]
+        for job, future in zip(jobs, futures):
             try:
-                client = texttospeech.TextToSpeechClient.from_service_account_file('google_tts_key.json')
-                synthesis_input = texttospeech.SynthesisInput(text=content_text)
-                voice = texttospeech.VoiceSelectionParams(
-                    language_code="vi-VN",
-                    name="vi-VN-Wavenet-C"  # Changed from vi-VN-Wavenet-A to vi-VN-Wavenet-C
-                )
-                audio_config = texttospeech.AudioConfig(
-                    audio_encoding=texttospeech.AudioEncoding.MP3,
-                    speaking_rate=1.25,
-                    pitch=0.0,
-                    sample_rate_hertz=44100
-                )
-                response = client.synthesize_speech(
-                    input=synthesis_input, voice=voice, audio_config=audio_config
-                )
-                audio_path = os.path.join(output_dir, "voiceover.mp3")
-                with open(audio_path, "wb") as out:
-                    out.write(response.audio_content)
-                print(f"  Saved audio at: {audio_path}")
+                result = future.result()
             except Exception as e:
-                print(f"  Error creating audio: {e}. Skipping row {selected_row_num}.")
+                print(f"  Error rendering row {job['row_num']} in worksheet '{job['worksheet']}': {e}")
                 continue
+            if result:
+                results.append(result)
+        return results
 
-            # Cut audio to max 55s using ffmpeg
+    for job in pending:
+        if stop is not None and stop.is_set():
+            break
+        result = process_row(job)
+        if result:
+            results.append(result)
+            if len(results) >= NUM_VIDEOS_TO_CREATE:
+                break
+    return results
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Render videos for pending Google Sheets rows")
+    parser.add_argument("--worker", action="store_true", help="Keep running and render rows as they appear")
+    parser.add_argument("--calibrate", action="store_true", help="Measure the candidate video encoders on this host and cache the choice")
+    parser.add_argument("--scan", action="store_true", help=f"Only check for pending rows (exit code {SCAN_IDLE_EXIT_CODE} when there are none)")
+    parser.add_argument("--poll-interval", type=float, default=WORKER_POLL_SECONDS, help="Seconds between polls while there is work")
+    parser.add_argument("--max-poll-interval", type=float, default=WORKER_MAX_POLL_SECONDS, help="Upper bound of the idle backoff")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.scan:
+        exit(0 if scan() else SCAN_IDLE_EXIT_CODE)
+    if args.calibrate:
+        get_encoder_profile(force_calibration=True)
+        return
+    if args.worker:
+        run_worker(args.poll_interval, args.max_poll_interval)
+        return
+    try:
+        with instrumentation.span("run", batch=BATCH_MODE, backend=RENDER_BACKEND):
+            run()
+    finally:
+        instrumentation.print_summary(instrumentation.summary())
+
+def run():
+    # Directory setup
+    print("Stage 1: Creating output directory...")
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"  Created directory: {output_dir}")
+
+    # Google Sheets setup
+    print("Stage 0: Initializing Google Sheets...")
+    sheet_access = sheets.SheetAccess(sheets.open_spreadsheet())
+    # Pick (or calibrate) the encoder once, before batch workers read the cached result
+    get_encoder_profile()
+
+    results = []
+    lease_manager = leases.LeaseManager(sheet_access)
+    pending = claim_jobs(iter_pending_rows(sheet_access, get_scan_cursor()), lease_manager)
+    with lease_manager.heartbeat():
+        if BATCH_MODE:
+            jobs = list(islice(pending, NUM_VIDEOS_TO_CREATE))
+            if jobs:
+                with ProcessPoolExecutor(max_workers=min(BATCH_WORKERS, len(jobs))) as pool:
+                    results = render_rows(iter(jobs), pool)
+        else:
+            # Process up to NUM_VIDEOS_TO_CREATE videos, one row at a time
+            results = render_rows(pending)
+    results = hand_off(results, lease_manager)
+
+    instrumentation.annotate(videos_created=len(results))
+    if not results:
+        print("No videos were created. Exiting.")
+        exit(1)
+
+    record_artifacts(results)
+    save_rendered_rows(results)
+    print(f"Successfully created {len(results)} video(s).")
+
+# Load what every row needs once: TTS client, fonts and glyph caches, HTTP session, caches
+def warm_up():
+    print("Warming up clients and fonts...")
+    import title_layout
+    get_http_session()
+    get_tts_cache()
+    get_image_cache()
+    get_encoder_profile()
+    if title_layout.fit_title("Khởi động bộ dựng video") is None:
+        print("  Warning: No custom font found.")
+    try:
+        tts.get_tts_client()
+    except Exception as e:
+        print(f"  Warning: TTS client not ready ({e}); it will be created on first use.")
+
+def _ignore_sigint():
+    # Batch workers finish their row; the parent decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+# Batch worker process setup for --worker: clients are created in the child, since a
+# gRPC channel (the TTS client) does not survive a fork
+def _init_batch_worker():
+    _ignore_sigint()
+    try:
+        warm_up()
+    except Exception as e:
+        print(f"  Warning: Batch worker warm-up failed ({e}); clients will be created on first use.")
+
+# Commit and push the new videos and the manifest (as the workflow does after main.py),
+# so their raw URLs resolve before column H points at them
+def push_videos(results):
+    paths = [result["video_path"] for result in results] + [MANIFEST_PATH]
+    titles = ", ".join(result["clean_title"] for result in results)
+    subprocess.run(["git", "add", "--"] + paths, check=True)
+    subprocess.run(["git", "commit", "-m", f"Add video for {titles}"], check=True)
+    subprocess.run(["git", "push"], check=True)
+
+# Push and publish a worker's rendered rows in-process. Rows that could not be
+# published are added to rendered_rows.json for update_sheet.py; returns their count.
+def publish_rendered_rows(results, sheet_access):
+    try:
+        push_videos(results)
+        unpublished = update_sheet.publish(results, sheet_access)
+    except Exception as e:
+        print(f"Worker could not publish: {e}")
+        unpublished = results
+    if unpublished:
+        save_rendered_rows(unpublished, append=True)
+    return len(unpublished)
+
+# Health/status file for the worker (written atomically, read by monitoring)
+def write_worker_status(status):
+    status["updated"] = round(time.time(), 3)
+    temp_path = f"{WORKER_STATUS_PATH}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(status, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, WORKER_STATUS_PATH)
+
+# Long-running worker: keeps the sheet, TTS and HTTP clients and the fonts warm and
+# polls for pending rows, backing off while the sheets are idle. Every rendered video
+# is pushed and its row published right away. SIGTERM/SIGINT stop it after the row
+# in progress.
+def run_worker(poll_interval=WORKER_POLL_SECONDS, max_poll_interval=WORKER_MAX_POLL_SECONDS):
+    os.makedirs(output_dir, exist_ok=True)
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        print(f"\nReceived {signal.Signals(signum).name}, stopping after the current row...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    status = {
+        "pid": os.getpid(),
+        "run_id": instrumentation.RUN_ID,
+        "state": "starting",
+        "started": round(time.time(), 3),
+        "polls": 0,
+        "rows_rendered": 0,
+        "rows_failed": 0,
+        "last_poll": None,
+        "next_poll": None,
+        "last_error": None,
+    }
+    write_worker_status(status)
+
+    pool = None
+    try:
+        sheet_access = sheets.SheetAccess(sheets.open_spreadsheet())
+        lease_manager = leases.LeaseManager(sheet_access)
+        cursor = get_scan_cursor()
+        if BATCH_MODE:
+            # Kept for the worker's lifetime so the batch processes stay warm too. The
+            # parent only picks the encoder (calibrating once for all of them).
+            get_encoder_profile()
+            pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS, initializer=_init_batch_worker)
+        else:
+            warm_up()
+
+        skip_until = {}  # (worksheet, row) -> time before which the row is not retried
+        interval = poll_interval
+        while not stop.is_set():
+            status.update(state="polling", last_poll=round(time.time(), 3))
+            status["polls"] += 1
+            write_worker_status(status)
+
+            attempted = []
+
+            def fresh_jobs():
+                now = time.time()
+                for job in iter_pending_rows(sheet_access, cursor):
+                    if skip_until.get((job["worksheet"], job["row_num"]), 0) <= now:
+                        yield job
+
+            def claimed_jobs():
+                for job in claim_jobs(fresh_jobs(), lease_manager):
+                    key = (job["worksheet"], job["row_num"])
+                    attempted.append(key)
+                    status.update(state="rendering", current={"worksheet": key[0], "row": key[1]})
+                    write_worker_status(status)
+                    yield job
+
+            results = []
             try:
-                temp_audio = os.path.join(output_dir, "temp_voiceover.mp3")
-                subprocess.run([
-                    "ffmpeg", "-i", audio_path, "-t", "55", "-c:a", "mp3", "-b:a", "96k", temp_audio
-                ], check=True, capture_output=True)
-                os.replace(temp_audio, audio_path)
-                print("  Cut audio to 55s with ffmpeg")
+                sheet_access.refresh()
+                with lease_manager.heartbeat():
+                    render_rows(claimed_jobs(), pool, stop, results)
+                status["last_error"] = None
             except Exception as e:
-                print(f"  Warning: Failed to cut audio with ffmpeg: {e}. Using original audio.")
-
-            # Stage 3: Create title image
-            def create_title_image(title, bg_image_url, output_path):
-                print("Stage 3: Creating title image...")
-                try:
-                    bg_image = Image.open(requests.get(bg_image_url, stream=True, timeout=10).raw).convert("RGB")
-                    print("  Downloaded background image.")
-                except Exception as e:
-                    print(f"  Warning: Failed to download background image: {e}. Using black background.")
-                    bg_image = Image.new("RGB", (720, 1280), (0, 0, 0))
-
-                target_size = (720, 1280)
-                img_ratio = bg_image.width / bg_image.height
-                target_ratio = target_size[0] / target_size[1]
-
-                if img_ratio > target_ratio:
-                    new_height = target_size[1]
-                    new_width = int(new_height * img_ratio)
-                else:
-                    new_width = target_size[0]
-                    new_height = int(new_width / img_ratio)
-
-                bg_image = bg_image.resize((new_width, new_height), Image.LANCZOS)
-                final_image = Image.new("RGB", target_size, (0, 0, 0))
-                paste_x = (target_size[0] - new_width) // 2
-                paste_y = (target_size[1] - new_height) // 2
-                final_image.paste(bg_image, (paste_x, paste_y))
-
-                draw = ImageDraw.Draw(final_image)
-                font_size = 80
-                font_paths = [
-                    "Roboto-Bold.ttf",
-                    "C:/Windows/Fonts/Arialbd.ttf",
-                    "C:/Windows/Fonts/Calibrib.ttf",
-                    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-                    "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf"
-                ]
-                font = None
-                for font_path in font_paths:
-                    try:
-                        font = ImageFont.truetype(font_path, font_size)
-                        print(f"  Using font: {font_path}")
-                        break
-                    except:
-                        continue
-                if not font:
-                    print("  Error: No custom font found. Default font is not suitable for font_size = 80. Please install a font like Arial or Roboto.")
-                    return
-
-                max_width = 576
-                min_height = 400
-                max_height = 768
-                target_height = 533
-                line_spacing = 15
-                wrap_width = 30
-
-                def get_text_dimensions(text, font, wrap_width):
-                    wrapped_text = []
-                    current_line = ""
-                    for word in text.split():
-                        test_line = current_line + (" " if current_line else "") + word
-                        text_bbox = draw.textbbox((0, 0), test_line, font=font)
-                        text_width = text_bbox[2] - text_bbox[0]
-                        if text_width <= max_width:
-                            current_line = test_line
-                        else:
-                            if current_line:
-                                wrapped_text.append(current_line)
-                            current_line = word
-                    if current_line:
-                        wrapped_text.append(current_line)
-
-                    total_height = 0
-                    max_text_width = 0
-                    for line in wrapped_text:
-                        text_bbox = draw.textbbox((0, 0), line, font=font)
-                        text_width = text_bbox[2] - text_bbox[0]
-                        text_height = text_bbox[3] - text_bbox[1]
-                        max_text_width = max(max_text_width, text_width)
-                        total_height += text_height + line_spacing
-                    return wrapped_text, max_text_width, total_height - line_spacing
-
-                wrapped_text, max_text_width, total_height = get_text_dimensions(title, font, wrap_width)
-
-                max_attempts = 20
-                attempt = 0
-                while (total_height < min_height or total_height > max_height) and wrap_width >= 10 and attempt < max_attempts:
-                    if total_height < min_height:
-                        wrap_width -= 1
-                    elif total_height > max_height:
-                        wrap_width += 1
-
-                    if wrap_width < 10:
-                        print("  Warning: wrap_width reached minimum (10). Cannot increase lines further.")
-                        break
-
-                    wrapped_text, max_text_width, total_height = get_text_dimensions(title, font, wrap_width)
-                    print(f"  Adjusted wrap_width: {wrap_width}, max_text_width: {max_text_width}, total_height: {total_height}, lines: {len(wrapped_text)}")
-                    attempt += 1
-
-                print(f"  Final font_size: {font_size}, wrap_width: {wrap_width}, max_text_width: {max_text_width}, total_height: {total_height}, lines: {len(wrapped_text)}")
-
-                text_area_height = total_height + 40
-                text_area = Image.new("RGBA", (720, text_area_height), (0, 0, 0, int(255 * 0.7)))
-                text_draw = ImageDraw.Draw(text_area)
-
-                current_y = 20
-                for line in wrapped_text:
-                    text_bbox = text_draw.textbbox((0, 0), line, font=font)
-                    text_width = text_bbox[2] - text_bbox[0]
-                    text_x = (720 - text_width) // 2
-                    text_draw.text((text_x, current_y), line, font=font, fill=(255, 255, 255), stroke_width=2, stroke_fill=(0, 0, 0))
-                    current_y += (text_bbox[3] - text_bbox[1]) + line_spacing
-
-                text_y = (1280 - text_area_height) // 2
-                final_image = final_image.convert("RGBA")
-                final_image.paste(text_area, (0, text_y), text_area)
-                final_image = final_image.convert("RGB")
-
-                final_image.save(output_path)
-                print(f"  Saved title image at: {output_path}")
-
-            title_image_path = os.path.join(output_dir, "title_image.jpg")
-            create_title_image(title_text, bg_image_url, title_image_path)
-            if not os.path.exists(title_image_path):
-                print(f"  Error: Failed to create title image for row {selected_row_num}. Skipping.")
-                continue
-
-            # Stage 4: Download images
-            def download_images_with_icrawler(keyword, num_images, output_dir):
-                print("Stage 4: Attempting to download images...")
-                keyword_clean = clean_filename(keyword)  # Clean keyword for directory
-                keyword_dir = os.path.join(output_dir, keyword_clean)
-                os.makedirs(keyword_dir, exist_ok=True)
-
-                try:
-                    from icrawler.builtin import GoogleImageCrawler
-                    google_crawler = GoogleImageCrawler(storage={'root_dir': keyword_dir})
-                    google_crawler.crawl(keyword=keyword, max_num=num_images, min_size=(500, 500))
-                    print(f"  Crawled images for keyword: {keyword}")
-                except ImportError:
-                    print("  Warning: icrawler not installed. Using fallback images.")
-                    return [title_image_path] * max(2, num_images)
-                except Exception as e:
-                    print(f"  Warning: Image crawling failed: {e}. Using fallback images.")
-                    return [title_image_path] * max(2, num_images)
-
-                image_pattern = os.path.join(keyword_dir, "*.jpg")
-                downloaded_files = glob.glob(image_pattern)
-                image_paths = []
-
-                if len(downloaded_files) < 2:
-                    print("  Warning: Not enough images downloaded. Using fallback.")
-                    return [title_image_path] * max(2, num_images)
-
-                for full_path in downloaded_files[:num_images]:
-                    try:
-                        img = Image.open(full_path).convert("RGB")
-                        img_ratio = img.width / img.height
-                        target_ratio = 720 / 1280
-
-                        if img_ratio > target_ratio:
-                            new_height = 1280
-                            new_width = int(new_height * img_ratio)
-                        else:
-                            new_width = 720
-                            new_height = int(new_width / img_ratio)
-
-                        img = img.resize((new_width, new_height), Image.LANCZOS)
-                        final_image = Image.new("RGB", (720, 1280), (0, 0, 0))
-                        paste_x = (720 - new_width) // 2
-                        paste_y = (1280 - new_height) // 2
-                        final_image.paste(img, (paste_x, paste_y))
-                        final_image.save(full_path)
-                        image_paths.append(full_path)
-                    except Exception as e:
-                        print(f"  Warning: Failed to process image {full_path}: {e}")
-                        continue
-
-                if not image_paths:
-                    print("  Warning: No valid images processed. Using fallback.")
-                    return [title_image_path] * max(2, num_images)
-
-                return image_paths
-
-            keyword = title_text[:50]
-            additional_images = download_images_with_icrawler(keyword, 10, output_dir)
-            image_paths = [title_image_path] + additional_images
-            print(f"  Retrieved {len(additional_images)} images")
-
-            # Stage 5: Create video with varied transitions
-            def create_video(image_paths, audio_path, output_path):
-                print("Stage 5: Creating video...")
-                try:
-                    audio = AudioFileClip(audio_path)
-                    audio_duration = audio.duration
-                except Exception as e:
-                    print(f"  Error loading audio {audio_path}: {e}. Skipping row {selected_row_num}.")
-                    return False
-
-                clips = []
-                num_images = len(image_paths)
-                title_duration = audio_duration * 1.2 / num_images
-                other_duration = (audio_duration - title_duration) / (num_images - 1) if num_images > 1 else audio_duration
-
-                def zoom_in(t, duration):
-                    return 1 + 0.2 * (t / duration)
-
-                def zoom_out(t, duration):
-                    return 1.2 - 0.2 * (t / duration)
-
-                def pan_left(t, duration):
-                    return (0.2 * (t / duration) * 720, 'center')
-
-                def pan_right(t, duration):
-                    return (-0.2 * (t / duration) * 720, 'center')
-
-                def pan_up(t, duration):
-                    return ('center', 0.2 * (t / duration) * 1280)
-
-                def pan_down(t, duration):
-                    return ('center', -0.2 * (t / duration) * 1280)
-
-                transitions = [zoom_in, zoom_out, pan_left, pan_right, pan_up, pan_down]
-
-                for i, img_path in enumerate(image_paths):
-                    try:
-                        duration = title_duration if i == 0 else other_duration
-                        clip = ImageClip(img_path, duration=duration)
-                        transition = transitions[i % len(transitions)]
-                        clip = clip.resize(lambda t: transition(t, duration) if transition in [zoom_in, zoom_out] else 1.0).set_position(lambda t: transition(t, duration) if transition not in [zoom_in, zoom_out] else 'center')
-                        clips.append(clip)
-                        print(f"  Applied transition {transition.__name__} to {img_path}")
-                    except Exception as e:
-                        print(f"  Warning: Failed to process image {img_path}: {e}")
-                        continue
-
-                if not clips:
-                    print(f"  Error: No valid clips to create video for row {selected_row_num}. Skipping.")
-                    return False
-
-                try:
-                    video = concatenate_videoclips(clips, method="compose")
-                    video = video.set_audio(audio)
-                    video.write_videofile(output_path, codec="libx265", audio_codec="aac", fps=15, bitrate="700k", audio_bitrate="96k", ffmpeg_params=["-preset", "medium"])
-                    print(f"  Saved video at: {output_path}")
-                    return True
-                except Exception as e:
-                    print(f"  Error saving video: {e}. Skipping row {selected_row_num}.")
-                    return False
-
-            output_video_path = os.path.join(output_dir, f"output_video_{clean_title}.mp4")
-            if create_video(image_paths, audio_path, output_video_path):
-                videos_created += 1
-                print(f"Video created successfully at: {output_video_path}")
-                print(f"Video size: {os.path.getsize(output_video_path) / (1024 * 1024):.2f} MB")
+                print(f"Worker poll failed: {e}")
+                status["last_error"] = repr(e)
+            try:
+                results = hand_off(results, lease_manager)
+            except Exception as e:
+                print(f"Worker could not hand off claims: {e}")
+                status["last_error"] = repr(e)
+                results = []
+
+            # Rendered rows are published below (or wait in rendered_rows.json); failed
+            # rows are retried later. Either way they are not picked up again right away.
+            retry_at = time.time() + WORKER_RETRY_SECONDS
+            for key in attempted:
+                skip_until[key] = retry_at
+            status["rows_rendered"] += len(results)
+            status["rows_failed"] += len(attempted) - len(results)
+            status.pop("current", None)
+
+            if results:
+                record_artifacts(results)
+                unpublished = publish_rendered_rows(results, sheet_access)
+                if unpublished:
+                    status["last_error"] = f"{unpublished} row(s) not published; left in rendered_rows.json"
+                interval = poll_interval
+            elif attempted or status["last_error"]:
+                interval = poll_interval
             else:
-                print(f"Failed to create video for row {selected_row_num} in worksheet '{worksheet_name}'.")
-
-            # Clean up temporary files (except video)
-            print("Cleaning up temporary files...")
-            keyword_clean = clean_filename(keyword)
-            for file in glob.glob(os.path.join(output_dir, keyword_clean, "*.jpg")):
-                try:
-                    os.remove(file)
-                except:
-                    pass
-            if os.path.exists(audio_path):
-                try:
-                    os.remove(audio_path)
-                except:
-                    pass
-            if os.path.exists(title_image_path):
-                try:
-                    os.remove(title_image_path)
-                except:
-                    pass
-            print("Cleanup complete.")
-
-if videos_created == 0:
-    print("No videos were created. Exiting.")
-    exit(1)
-
-print(f"Successfully created {videos_created} video(s).")
+                interval = min(interval * 2, max_poll_interval)  # Idle: back off
+
+            status.update(state="idle", next_poll=round(time.time() + interval, 3))
+            write_worker_status(status)
+            print(f"Next poll in {interval:.0f}s")
+            stop.wait(interval)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True)
+        status.update(state="stopped", next_poll=None)
+        write_worker_status(status)
+        instrumentation.print_summary(instrumentation.summary())
+
+if __name__ == "__main__":
+    main()
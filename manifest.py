@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import time
+import bisect
+import hashlib
+import argparse
+import threading
+import subprocess
+import instrumentation
+
+# Append-only record of the generated videos. Every line is one event for an artifact
+# path: created (hash, sheet row, size, duration), published (URL), used or deleted.
+# Loading the file folds the events into the current state of each artifact and
+# builds in-memory indexes (by path, sheet row, URL and creation time), so expiry,
+# used-video deletion and size reporting are lookups instead of walks over git
+# history or re-parsed sheet URLs. The file is committed next to the videos and
+# .gitattributes merges it with merge=union, so concurrent runs never conflict.
+#
+#   python manifest.py report
+#   python manifest.py expire --days 90
+
+MANIFEST_PATH = os.path.join("output", "manifest.jsonl")
+OUTPUT_DIR = "output"
+RAW_URL_BASE = "https://raw.githubusercontent.com/gx288/shortvideo/main"
+EVENTS = ("created", "published", "used", "deleted")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Repository-relative path with forward slashes, the form used as the manifest key
+def artifact_path(path):
+    return os.path.relpath(path).replace(os.sep, "/")
+
+
+def raw_url(path):
+    return f"{RAW_URL_BASE}/{artifact_path(path)}"
+
+
+class Manifest:
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self.artifacts = {}  # path -> current state
+        self.by_row = {}  # (worksheet, row) -> path
+        self.by_url = {}  # published URL -> path
+        self.by_created = []  # sorted (created_at, path)
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # A torn line must not hide the rest of the history
+                    if record.get("event") in EVENTS and record.get("path"):
+                        self._apply(record)
+        except FileNotFoundError:
+            pass
+
+    def _apply(self, record):
+        path = record["path"]
+        event = record["event"]
+        if event == "created":
+            # A path rendered again (same title) starts a new lifecycle
+            old = self.artifacts.get(path)
+            if old and "created_at" in old:
+                index = bisect.bisect_left(self.by_created, (old["created_at"], path))
+                if index < len(self.by_created) and self.by_created[index] == (old["created_at"], path):
+                    del self.by_created[index]
+            self.artifacts[path] = {"path": path}
+            bisect.insort(self.by_created, (record["time"], path))
+        artifact = self.artifacts.setdefault(path, {"path": path})
+        artifact.update({key: value for key, value in record.items() if key not in ("event", "time", "path")})
+        artifact["state"] = event
+        artifact[f"{event}_at"] = record["time"]
+        if artifact.get("worksheet") and artifact.get("row"):
+            self.by_row[(artifact["worksheet"], artifact["row"])] = path
+        if artifact.get("url"):
+            self.by_url[artifact["url"]] = path
+
+    # Append one event and apply it; when defaults to now
+    def record(self, event, path, when=None, **fields):
+        if event not in EVENTS:
+            raise ValueError(f"Unknown manifest event: {event}")
+        record = {"event": event, "path": artifact_path(path), "time": round(when or time.time(), 3), **fields}
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self._apply(record)
+        return record
+
+    def record_created(self, path, worksheet=None, row=None, duration=None, when=None, **fields):
+        return self.record("created", path, when=when, sha256=file_sha256(path), size=os.path.getsize(path),
+                           worksheet=worksheet, row=row,
+                           duration=round(duration, 2) if duration is not None else None, **fields)
+
+    def get(self, path):
+        return self.artifacts.get(artifact_path(path))
+
+    def find_by_url(self, url):
+        path = self.by_url.get(url)
+        return self.artifacts.get(path) if path else None
+
+    def find_by_row(self, worksheet, row):
+        path = self.by_row.get((worksheet, row))
+        return self.artifacts.get(path) if path else None
+
+    # Artifacts that have not been deleted
+    def live(self):
+        return [artifact for artifact in self.artifacts.values() if artifact["state"] != "deleted"]
+
+    # Live artifacts created before now - max_age seconds, oldest first
+    def expired(self, max_age, now=None):
+        cutoff = (now or time.time()) - max_age
+        end = bisect.bisect_left(self.by_created, (cutoff, ""))
+        return [self.artifacts[path] for _, path in self.by_created[:end]
+                if self.artifacts[path]["state"] != "deleted"]
+
+    # Videos in directory that predate the manifest get a created event dated by the
+    # commit that added them (the checkout may be shallow, then that is the newest one)
+    def backfill(self, directory=OUTPUT_DIR):
+        added = 0
+        for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+            path = artifact_path(os.path.join(directory, name))
+            if not (name.startswith("output_video_") and name.endswith(".mp4")):
+                continue
+            artifact = self.artifacts.get(path)
+            if artifact and artifact["state"] != "deleted":
+                continue
+            result = subprocess.run(["git", "log", "--diff-filter=A", "--format=%ct", "-1", "--", path],
+                                    capture_output=True, text=True)
+            when = float(result.stdout.strip()) if result.returncode == 0 and result.stdout.strip() else os.path.getmtime(path)
+            self.record_created(path, when=when, backfilled=True)
+            added += 1
+        return added
+
+    def report(self):
+        live = self.live()
+        return {
+            "live": len(live),
+            "bytes": sum(artifact.get("size") or 0 for artifact in live),
+            "published": sum(1 for artifact in live if artifact.get("published_at")),
+            "used": sum(1 for artifact in live if artifact.get("used_at")),
+            "deleted": len(self.artifacts) - len(live),
+        }
+
+
+# git rm the files, record them as deleted and commit the removals with the manifest
+def delete_artifacts(manifest, artifacts, reason, message):
+    deleted = 0
+    for artifact in artifacts:
+        path = artifact["path"]
+        if os.path.exists(path):
+            try:
+                subprocess.run(["git", "rm", "-q", path], check=True)
+                print(f"  Removed {path} from git")
+            except subprocess.CalledProcessError as e:
+                print(f"  Warning: Failed to remove {path}: {e}")
+                continue
+        manifest.record("deleted", path, reason=reason)
+        instrumentation.count("files_deleted")
+        deleted += 1
+    if deleted:
+        try:
+            subprocess.run(["git", "add", manifest.path], check=True)
+            subprocess.run(["git", "commit", "-m", message], check=True)
+            subprocess.run(["git", "push"], check=True)
+            print("  Committed and pushed deletions")
+        except subprocess.CalledProcessError as e:
+            print(f"  Warning: Failed to commit/push deletions: {e}")
+    return deleted
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Query and maintain the video artifact manifest")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("report", help="Print counts and total size of live videos")
+    expire = commands.add_parser("expire", help="Delete videos older than --days")
+    expire.add_argument("--days", type=float, default=90)
+    expire.add_argument("--dry-run", action="store_true", help="Only list the expired videos")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    manifest = Manifest()
+    if args.command == "report":
+        report = manifest.report()
+        print(f"{report['live']} live video(s), {report['bytes'] / (1024 * 1024):.1f} MB"
+              f" ({report['published']} published, {report['used']} used); {report['deleted']} deleted")
+        return
+
+    with instrumentation.span("expire", days=args.days):
+        backfilled = manifest.backfill()
+        if backfilled:
+            print(f"Added {backfilled} video(s) created before the manifest")
+        expired = manifest.expired(args.days * 24 * 60 * 60)
+        if not expired:
+            print("No old videos to clean up")
+            return
+        for artifact in expired:
+            print(f"Expired: {artifact['path']} (created {time.strftime('%Y-%m-%d', time.gmtime(artifact['created_at']))})")
+        if args.dry_run:
+            return
+        delete_artifacts(manifest, expired, "expired", f"Cleanup videos older than {args.days:g} days")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+import os
+import re
+import json
+import time
+import threading
+import gspread
+import instrumentation
+from google.oauth2.service_account import Credentials
+
+# Google Sheets access shared by main.py, update_sheet.py and delete_used_videos.py.
+# The spreadsheet is opened once, only the columns the pipeline uses are read (one
+# batch_get for all worksheets) and writes are queued and sent as one batch_update.
+
+SHEET_ID = '14tqKftTqlesnb0NqJZU-_f1EsWWywYqO36NiuDdmaTo'
+SHEETS_KEY_FILE = 'google_sheets_key.json'
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+# Column the runners write their row claims to (see leases.py). It must be a column
+# the sheet does not use for anything else: a cell holding other data is never
+# claimed or cleared, so that row is not rendered until the cell is emptied.
+CLAIM_COLUMN = "J"
+
+# B: post content, D: cover image URL, H: video URL, I: used / size flag, CLAIM_COLUMN
+PIPELINE_COLUMNS = ("B", "D", "H", "I", CLAIM_COLUMN)
+
+
+def column_index(letter):
+    index = 0
+    for char in letter.upper():
+        index = index * 26 + (ord(char) - ord('A') + 1)
+    return index - 1
+
+
+def column_letter(index):
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def a1_range(worksheet_name, a1):
+    return "'{}'!{}".format(worksheet_name.replace("'", "''"), a1)
+
+
+def open_spreadsheet(sheet_id=SHEET_ID, key_file=SHEETS_KEY_FILE):
+    creds = Credentials.from_service_account_file(key_file, scopes=SCOPES)
+    gc = gspread.authorize(creds)
+    return gc.open_by_key(sheet_id)
+
+
+class SheetAccess:
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+        self.pending_writes = []
+        self.api_calls = 0
+        self._titles = None
+
+    def _api_call(self):
+        self.api_calls += 1
+        instrumentation.count("sheets_api_calls")
+
+    def worksheet_titles(self):
+        if self._titles is None:
+            self._api_call()
+            self._titles = [worksheet.title for worksheet in self.spreadsheet.worksheets()]
+        return self._titles
+
+    # Forget cached metadata (worksheet titles) so a long-running worker sees new worksheets
+    def refresh(self):
+        self._titles = None
+
+    # Read the given columns of every worksheet in one request. Returns
+    # {worksheet_name: rows} where each row is a list indexed like get_all_values()
+    # (column B at index 1, H at index 7, ...), padded with ''. Rows start at
+    # first_rows[name] (default 2, right after the header), so rows[i] is sheet row
+    # first_row + i. Worksheets that do not exist are left out of the result.
+    def fetch_rows(self, worksheet_names, columns=PIPELINE_COLUMNS, first_rows=None):
+        existing = set(self.worksheet_titles())
+        names = [name for name in worksheet_names if name in existing]
+        if not names:
+            return {}
+        first_rows = first_rows or {}
+        ranges = [a1_range(name, f"{column}{first_rows.get(name, 2)}:{column}") for name in names for column in columns]
+        self._api_call()
+        response = self.spreadsheet.values_batch_get(ranges)
+        value_ranges = response.get("valueRanges", [])
+
+        width = max(column_index(column) for column in columns) + 1
+        result = {}
+        for n, name in enumerate(names):
+            column_values = {}
+            for c, column in enumerate(columns):
+                values = value_ranges[n * len(columns) + c].get("values", [])
+                column_values[column_index(column)] = [cell[0] if cell else '' for cell in values]
+            num_rows = max((len(values) for values in column_values.values()), default=0)
+            rows = []
+            for r in range(num_rows):
+                row = [''] * width
+                for index, values in column_values.items():
+                    if r < len(values):
+                        row[index] = values[r]
+                rows.append(row)
+            result[name] = rows
+        return result
+
+    # Read the given columns of specific rows in one request. rows_by_worksheet maps
+    # worksheet names to 1-based row numbers; returns {(worksheet_name, row): row}
+    # with rows indexed like fetch_rows. Worksheets that do not exist are left out.
+    def fetch_cells(self, rows_by_worksheet, columns=PIPELINE_COLUMNS):
+        existing = set(self.worksheet_titles())
+        wanted = [(name, row) for name, rows in rows_by_worksheet.items() if name in existing
+                  for row in sorted(set(rows))]
+        if not wanted:
+            return {}
+        first = min(column_index(column) for column in columns)
+        last = max(column_index(column) for column in columns)
+        ranges = [a1_range(name, f"{column_letter(first)}{row}:{column_letter(last)}{row}") for name, row in wanted]
+        self._api_call()
+        value_ranges = self.spreadsheet.values_batch_get(ranges).get("valueRanges", [])
+        result = {}
+        for key, value_range in zip(wanted, value_ranges):
+            values = value_range.get("values", [])
+            row = [''] * (last + 1)
+            for offset, value in enumerate(values[0] if values else []):
+                row[first + offset] = value
+            result[key] = row
+        return result
+
+    # Queue a single-cell write (1-based row and column, like update_cell)
+    def queue_update(self, worksheet_name, row, column, value):
+        a1 = a1_range(worksheet_name, f"{column_letter(column - 1)}{row}")
+        self.pending_writes.append({"range": a1, "values": [[value]]})
+
+    # Send all queued writes as one batch_update
+    def flush(self):
+        if not self.pending_writes:
+            return 0
+        count = len(self.pending_writes)
+        self._send(self.pending_writes)
+        self.pending_writes = []
+        return count
+
+    # Drop the queued writes (after a failed flush, so the next one does not resend them)
+    def discard(self):
+        self.pending_writes = []
+
+    # Write cells right away as one batch_update, leaving the queue alone.
+    # updates: [(worksheet_name, row, column, value)] with 1-based row and column.
+    def write_cells(self, updates):
+        self._send([{"range": a1_range(name, f"{column_letter(column - 1)}{row}"), "values": [[value]]}
+                    for name, row, column, value in updates])
+        return len(updates)
+
+    def _send(self, data):
+        self._api_call()
+        self.spreadsheet.values_batch_update({
+            "valueInputOption": "USER_ENTERED",
+            "data": data,
+        })
+
+
+# Local cursor that lets a scan start at the first row that may still be pending
+# instead of row 2. Rows above a worksheet's cursor had column H filled when it was
+# saved, so they are skipped; every full_scan_interval seconds the cursor is ignored
+# once to pick up edits above it (cleared cells, inserted rows).
+class ScanCursor:
+    def __init__(self, path, full_scan_interval=24 * 60 * 60):
+        self.path = path
+        self.full_scan_interval = full_scan_interval
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.state = {}
+        self.state.setdefault("first_rows", {})
+        self.full_scan = False
+
+    # {worksheet_name: first row to read}; empty when a full scan is due
+    def first_rows(self):
+        self.full_scan = time.time() - self.state.get("last_full_scan", 0) >= self.full_scan_interval
+        return {} if self.full_scan else dict(self.state["first_rows"])
+
+    # The next save records a full scan (used when a cursor read had to be retried in full)
+    def force_full_scan(self):
+        self.full_scan = True
+
+    def update(self, worksheet_name, first_row):
+        self.state["first_rows"][worksheet_name] = max(2, int(first_row))
+
+    def save(self):
+        if self.full_scan:
+            self.state["last_full_scan"] = time.time()
+            self.full_scan = False
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+
+
+# In-memory stand-in for gspread.Spreadsheet, supporting the calls SheetAccess makes.
+# data maps worksheet names to lists of rows (header included), like get_all_values().
+class FakeSpreadsheet:
+    class Worksheet:
+        def __init__(self, title):
+            self.title = title
+
+    def __init__(self, data):
+        self.data = {name: [list(row) for row in rows] for name, rows in data.items()}
+        self.calls = []
+        self._lock = threading.Lock()  # Several runners (threads) may share one fake
+
+    def worksheets(self):
+        self.calls.append("worksheets")
+        return [self.Worksheet(name) for name in self.data]
+
+    @staticmethod
+    def _parse_range(a1_range_text):
+        match = re.match(r"^'((?:[^']|'')*)'!([A-Z]+)(\d*)(?::([A-Z]+)(\d*))?$", a1_range_text)
+        if not match:
+            raise ValueError(f"Unsupported range: {a1_range_text}")
+        name, start_col, start_row, end_col, end_row = match.groups()
+        start_row = int(start_row) if start_row else 1
+        if end_col is None:
+            end_col, end_row = start_col, start_row
+        else:
+            end_row = int(end_row) if end_row else None
+        return name.replace("''", "'"), column_index(start_col), column_index(end_col), start_row, end_row
+
+    def values_batch_get(self, ranges, params=None):
+        with self._lock:
+            return self._batch_get(ranges)
+
+    def _batch_get(self, ranges):
+        self.calls.append("values_batch_get")
+        value_ranges = []
+        for a1 in ranges:
+            name, first_col, last_col, first_row, last_row = self._parse_range(a1)
+            rows = self.data[name]
+            last_row = len(rows) if last_row is None else min(last_row, len(rows))
+            values = []
+            for row in rows[first_row - 1:last_row]:
+                cells = [row[c] if c < len(row) else '' for c in range(first_col, last_col + 1)]
+                while cells and cells[-1] == '':
+                    cells.pop()
+                values.append(cells)
+            while values and not values[-1]:
+                values.pop()
+            value_ranges.append({"range": a1, "values": values} if values else {"range": a1})
+        return {"valueRanges": value_ranges}
+
+    def values_batch_update(self, body):
+        with self._lock:
+            return self._batch_update(body)
+
+    def _batch_update(self, body):
+        self.calls.append("values_batch_update")
+        for update in body["data"]:
+            name, first_col, _, first_row, _ = self._parse_range(update["range"])
+            rows = self.data[name]
+            for r, values in enumerate(update["values"]):
+                while len(rows) < first_row + r:
+                    rows.append([])
+                row = rows[first_row + r - 1]
+                for c, value in enumerate(values):
+                    while len(row) <= first_col + c:
+                        row.append('')
+                    row[first_col + c] = value
+        return {"totalUpdatedCells": len(body["data"])}
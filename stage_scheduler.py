@@ -0,0 +1,113 @@
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Small dependency-graph scheduler for the per-row stages. Every stage whose
+# dependencies are done is started on a thread pool straight away, so network-bound
+# stages overlap. A stage that raises or runs past its timeout is replaced by its
+# fallback; a stage without a fallback fails, and so do the stages that depend on it.
+# A timed-out stage keeps running on its thread, so files it writes must not be shared
+# with its fallback, and cleanup of its files waits for it (after_abandoned).
+
+_NO_FALLBACK = object()
+
+
+class StageFailed(Exception):
+    pass
+
+
+class Stage:
+    def __init__(self, name, fn, deps, timeout, fallback):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.timeout = timeout
+        self.fallback = fallback
+
+
+class StageGraph:
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.stages = {}
+        self.abandoned = []  # Futures of timed-out stages that may still be running
+
+    # fn receives the results of its dependencies as keyword arguments. fallback is
+    # called with the exception (StageFailed on timeout) and its return value is used
+    # as the stage result.
+    def add(self, name, fn, deps=(), timeout=None, fallback=_NO_FALLBACK):
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+        self.stages[name] = Stage(name, fn, deps, timeout, fallback)
+        return self
+
+    # Run every stage; returns (results, errors) keyed by stage name
+    def run(self):
+        results = {}
+        errors = {}
+        running = {}  # future -> (stage, deadline)
+        pending = list(self.stages.values())
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        def finish(stage, error):
+            if stage.fallback is _NO_FALLBACK:
+                errors[stage.name] = error
+                print(f"  Stage '{stage.name}' failed: {error}")
+                return
+            print(f"  Stage '{stage.name}' failed ({error}), using fallback")
+            try:
+                results[stage.name] = stage.fallback(error)
+            except Exception as e:
+                errors[stage.name] = e
+
+        try:
+            while pending or running:
+                for stage in list(pending):
+                    if any(dep in errors for dep in stage.deps):
+                        pending.remove(stage)
+                        errors[stage.name] = StageFailed(f"dependency of '{stage.name}' failed")
+                    elif all(dep in results for dep in stage.deps):
+                        pending.remove(stage)
+                        kwargs = {dep: results[dep] for dep in stage.deps}
+                        deadline = time.monotonic() + stage.timeout if stage.timeout else None
+                        # Run in a copy of the caller's context so instrumentation spans nest
+                        context = contextvars.copy_context()
+                        running[executor.submit(context.run, stage.fn, **kwargs)] = (stage, deadline)
+                if not running:
+                    continue
+
+                deadlines = [deadline for _, deadline in running.values() if deadline]
+                timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, _ = running.pop(future)
+                    try:
+                        results[stage.name] = future.result()
+                    except Exception as e:
+                        finish(stage, e)
+                now = time.monotonic()
+                for future, (stage, deadline) in list(running.items()):
+                    if deadline and now >= deadline:
+                        # The thread cannot be killed; its result is ignored
+                        running.pop(future)
+                        if not future.cancel():
+                            self.abandoned.append(future)
+                        finish(stage, StageFailed(f"timed out after {stage.timeout}s"))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return results, errors
+
+    # Call fn once every abandoned stage has returned: right away if none is still
+    # running, otherwise on a background thread, so the caller does not wait for them
+    def after_abandoned(self, fn):
+        still_running = [future for future in self.abandoned if not future.done()]
+        if not still_running:
+            fn()
+            return
+
+        def run_after():
+            wait(still_running)
+            fn()
+
+        threading.Thread(target=run_after, name="after-abandoned-stages", daemon=True).start()
@@ -0,0 +1,178 @@
+import os
+import time
+import tempfile
+import subprocess
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import instrumentation
+import ffmpeg_render
+
+# Render backend that composites frames in Python with bounded memory and pipes them
+# to ffmpeg as raw RGB on stdin. Takes the same clip plan as ffmpeg_render; its images
+# may also be .npy frames from image_cache, which is how main.py hands crawled frames
+# over. Only the current source image and the next one (loaded in the background)
+# are held. Every output frame is computed into the same preallocated buffers with
+# vectorized crop-and-scale, so peak memory does not depend on image count or
+# duration.
+# Transitions follow the moviepy ones in main.py: zooms scale up to 1.2x around the
+# center, pans slide the image over a black canvas.
+
+FRAME_WIDTH = ffmpeg_render.FRAME_WIDTH
+FRAME_HEIGHT = ffmpeg_render.FRAME_HEIGHT
+
+
+# Output frame buffer plus the scratch buffers of the bilinear crop-and-scale
+class FrameCompositor:
+    def __init__(self, width=FRAME_WIDTH, height=FRAME_HEIGHT):
+        self.width = width
+        self.height = height
+        self.frame = np.zeros((height, width, 3), dtype=np.uint8)
+        self._top = np.empty((height, width, 3), dtype=np.uint8)
+        self._bottom = np.empty((height, width, 3), dtype=np.uint8)
+        self._rows = np.empty((height, width, 3), dtype=np.float32)
+        self._left = np.empty((height, width, 3), dtype=np.float32)
+        self._right = np.empty((height, width, 3), dtype=np.float32)
+
+    # Sample positions of a window of size/zoom centered in a source of the same size:
+    # (lower index, upper index, weight of the upper one)
+    @staticmethod
+    def _taps(size, zoom):
+        positions = (np.arange(size, dtype=np.float32) + 0.5 - size / 2) / zoom + size / 2 - 0.5
+        np.clip(positions, 0, size - 1, out=positions)
+        lower = np.floor(positions).astype(np.intp)
+        upper = np.minimum(lower + 1, size - 1)
+        return lower, upper, positions - lower
+
+    # Center crop of 1/zoom of the source, scaled back to the full frame
+    def zoom(self, source, zoom):
+        y0, y1, fy = self._taps(self.height, zoom)
+        x0, x1, fx = self._taps(self.width, zoom)
+        # Rows first (uint8 gathers), then columns on the blended rows
+        np.take(source, y0, axis=0, out=self._top, mode="clip")
+        np.take(source, y1, axis=0, out=self._bottom, mode="clip")
+        np.subtract(self._bottom, self._top, out=self._rows, dtype=np.float32)
+        self._rows *= fy[:, None, None]
+        self._rows += self._top
+        np.take(self._rows, x0, axis=1, out=self._left, mode="clip")
+        np.take(self._rows, x1, axis=1, out=self._right, mode="clip")
+        self._right -= self._left
+        self._right *= fx[None, :, None]
+        self._right += self._left
+        self._right += 0.5
+        np.copyto(self.frame, self._right, casting="unsafe")
+        return self.frame
+
+    # Source moved by (dx, dy) pixels over black
+    def shift(self, source, dx, dy):
+        frame = self.frame
+        frame.fill(0)
+        w, h = self.width, self.height
+        if abs(dx) >= w or abs(dy) >= h:
+            return frame
+        frame[max(dy, 0):h + min(dy, 0), max(dx, 0):w + min(dx, 0)] = \
+            source[max(-dy, 0):h - max(dy, 0), max(-dx, 0):w - max(dx, 0)]
+        return frame
+
+    # Frame `progress` (0..1) of a transition
+    def render(self, source, transition, progress):
+        amount = ffmpeg_render.ZOOM_AMOUNT
+        if transition == "zoom_in":
+            return self.zoom(source, 1 + amount * progress)
+        if transition == "zoom_out":
+            return self.zoom(source, 1 + amount - amount * progress)
+        pan_x = int(ffmpeg_render.PAN_AMOUNT * self.width * progress)
+        pan_y = int(ffmpeg_render.PAN_AMOUNT * self.height * progress)
+        if transition == "pan_left":
+            return self.shift(source, pan_x, 0)
+        if transition == "pan_right":
+            return self.shift(source, -pan_x, 0)
+        if transition == "pan_up":
+            return self.shift(source, 0, pan_y)
+        if transition == "pan_down":
+            return self.shift(source, 0, -pan_y)
+        np.copyto(self.frame, source)
+        return self.frame
+
+
+# Frame-sized uint8 RGB array for a plan image (an image file, a .npy frame or an
+# in-memory frame)
+def load_source(image, width=FRAME_WIDTH, height=FRAME_HEIGHT):
+    if isinstance(image, str) and image.endswith(".npy"):
+        image = np.load(image, allow_pickle=False)
+    if isinstance(image, np.ndarray) and image.shape == (height, width, 3) and image.dtype == np.uint8:
+        return image
+    import image_pipeline
+    from PIL import Image
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(np.asarray(image, dtype=np.uint8))
+    return np.ascontiguousarray(image_pipeline.load_frame(image, (width, height)))
+
+
+# Yield every output frame of the plan (the same buffer each time). The next source
+# is decoded on a background thread while the current segment renders.
+def iter_frames(plan, fps):
+    compositor = FrameCompositor()
+    with ThreadPoolExecutor(max_workers=1) as loader:
+        upcoming = loader.submit(load_source, plan[0][0]) if plan else None
+        for i, (_, duration, transition) in enumerate(plan):
+            source = upcoming.result()
+            upcoming = loader.submit(load_source, plan[i + 1][0]) if i + 1 < len(plan) else None
+            frames = max(1, round(duration * fps))
+            for n in range(frames):
+                yield compositor.render(source, transition, n / frames)
+            source = None
+
+
+# ffmpeg command reading raw RGB frames from stdin; the rest as ffmpeg_render.output_args
+def build_command(audio_path, output_path, fps=15, pass_number=None, renditions=(), captions_path=None, **kwargs):
+    if pass_number == 1:
+        renditions = ()
+    cmd = [
+        "ffmpeg", "-y", "-hide_banner",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-video_size", f"{FRAME_WIDTH}x{FRAME_HEIGHT}",
+        "-framerate", str(fps), "-i", "-",
+    ]
+    if pass_number != 1:
+        cmd += ["-i", audio_path]
+    cmd += ["-filter_complex", ";".join(ffmpeg_render.output_filters("[0:v]", fps, renditions, captions_path))]
+    return cmd + ffmpeg_render.output_args("1:a", output_path, fps, pass_number=pass_number, renditions=renditions, **kwargs)
+
+
+# Run one ffmpeg process fed with the plan's frames. stderr goes to a file so a full
+# pipe can never stall the encoder while frames are written.
+def encode(plan, cmd, fps):
+    with tempfile.TemporaryFile() as log:
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=log)
+        try:
+            for frame in iter_frames(plan, fps):
+                process.stdin.write(frame.data)
+        except BrokenPipeError:
+            pass  # ffmpeg exited early; its return code and log tell why
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            returncode = process.wait()
+        log.seek(0)
+        stderr = log.read()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, cmd, stderr=stderr)
+    return stderr
+
+
+# Render the clip plan through stdin (two passes over the frames for a two_pass
+# encode). Returns ffmpeg's encode statistics, or None if they could not be parsed.
+def render_video(plan, audio_path, output_path, encode_mode="fixed", fps=15, **kwargs):
+    start = time.perf_counter()
+    if encode_mode == "two_pass":
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_path))) as temp_dir:
+            stats_path = os.path.join(temp_dir, "passlog")
+            for pass_number in (1, 2):
+                cmd = build_command(audio_path, output_path, fps, encode_mode=encode_mode,
+                                    pass_number=pass_number, stats_path=stats_path, **kwargs)
+                start = time.perf_counter()  # The second pass is the one reported
+                stderr = encode(plan, cmd, fps)
+    else:
+        stderr = encode(plan, build_command(audio_path, output_path, fps, encode_mode=encode_mode, **kwargs), fps)
+    return instrumentation.parse_ffmpeg_stats(stderr, time.perf_counter() - start, fps)
@@ -0,0 +1,165 @@
+from functools import lru_cache
+from PIL import ImageFont
+
+# Title-card text layout. Fonts and per-glyph advance widths are cached per process,
+# lines are measured by summing cached advances, and the font size / wrap width are
+# found by binary search so the text block lands in the MIN_HEIGHT..MAX_HEIGHT band
+# and no line is wider than MAX_WIDTH.
+
+FONT_PATHS = [
+    "Roboto-Bold.ttf",
+    "C:/Windows/Fonts/Arialbd.ttf",
+    "C:/Windows/Fonts/Calibrib.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf"
+]
+
+MAX_WIDTH = 576
+MIN_WIDTH = 360  # Narrowest wrap width tried when a title is too short for the band
+MIN_HEIGHT = 400
+MAX_HEIGHT = 768
+TARGET_HEIGHT = 533
+LINE_SPACING = 15
+MIN_FONT_SIZE = 40
+MAX_FONT_SIZE = 110
+
+
+class TitleLayout:
+    def __init__(self, lines, font, font_path, font_size, wrap_width, line_boxes, line_height, max_text_width, total_height):
+        self.lines = lines
+        self.font = font
+        self.font_path = font_path
+        self.font_size = font_size
+        self.wrap_width = wrap_width
+        self.line_boxes = line_boxes  # textbbox-style (left, top, right, bottom) per line
+        self.line_height = line_height  # Distance between baselines is line_height + LINE_SPACING
+        self.max_text_width = max_text_width
+        self.total_height = total_height
+
+
+# First font in FONT_PATHS that loads, probed once per process
+@lru_cache(maxsize=None)
+def find_font_path():
+    for font_path in FONT_PATHS:
+        try:
+            ImageFont.truetype(font_path, 10)
+            return font_path
+        except OSError:
+            continue
+    return None
+
+
+@lru_cache(maxsize=64)
+def load_font(font_path, font_size):
+    return ImageFont.truetype(font_path, font_size)
+
+
+@lru_cache(maxsize=65536)
+def glyph_advance(font_path, font_size, char):
+    return load_font(font_path, font_size).getlength(char)
+
+
+# Line height from the font's vertical metrics (same for every line of a size)
+@lru_cache(maxsize=256)
+def line_height(font_path, font_size):
+    ascent, descent = load_font(font_path, font_size).getmetrics()
+    return ascent + descent
+
+
+def text_width(text, font_path, font_size):
+    return sum(glyph_advance(font_path, font_size, char) for char in text)
+
+
+def widest_word(words, font_path, font_size):
+    return max((text_width(word, font_path, font_size) for word in words), default=0.0)
+
+
+# Words wider than max_width broken into pieces that fit, after a "/" or "-" where
+# possible (only at MIN_FONT_SIZE, when a smaller font is not an option)
+def split_long_words(words, font_path, font_size, max_width=MAX_WIDTH):
+    pieces = []
+    for word in words:
+        while text_width(word, font_path, font_size) > max_width:
+            fit = 1  # Longest prefix that fits (at least one character)
+            while fit < len(word) and text_width(word[:fit + 1], font_path, font_size) <= max_width:
+                fit += 1
+            cut = max((i + 1 for i in range(fit) if word[i] in "/-"), default=fit)
+            pieces.append(word[:cut])
+            word = word[cut:]
+        pieces.append(word)
+    return pieces
+
+
+# Greedy word wrap at wrap_width pixels
+def wrap_words(words, font_path, font_size, wrap_width):
+    space = glyph_advance(font_path, font_size, " ")
+    lines = []
+    current = []
+    current_width = 0.0
+    for word in words:
+        word_width = text_width(word, font_path, font_size)
+        width = current_width + space + word_width if current else word_width
+        if current and width > wrap_width:
+            lines.append(" ".join(current))
+            current = [word]
+            current_width = word_width
+        else:
+            current.append(word)
+            current_width = width
+    if current:
+        lines.append(" ".join(current))
+    return lines
+
+
+def block_height(num_lines, font_path, font_size):
+    return num_lines * line_height(font_path, font_size) + (num_lines - 1) * LINE_SPACING
+
+
+def _measure(words, font_path, font_size, wrap_width):
+    lines = wrap_words(split_long_words(words, font_path, font_size), font_path, font_size, wrap_width)
+    return lines, block_height(len(lines), font_path, font_size)
+
+
+# Largest wrap width / font size pair whose block height is closest to TARGET_HEIGHT
+# without exceeding MAX_HEIGHT, at a size where every word fits in MAX_WIDTH. Height
+# and word width grow with font size and height shrinks with wrap width, so both
+# searches are binary searches.
+def fit_title(title, font_path=None):
+    font_path = font_path or find_font_path()
+    if not font_path:
+        return None
+    words = title.split()
+
+    # Font size: largest size at the full wrap width that stays at or below TARGET_HEIGHT
+    # with the widest word within MAX_WIDTH (a longer word is split at MIN_FONT_SIZE)
+    low, high = MIN_FONT_SIZE, MAX_FONT_SIZE
+    while low < high:
+        mid = (low + high + 1) // 2
+        if (widest_word(words, font_path, mid) <= MAX_WIDTH
+                and _measure(words, font_path, mid, MAX_WIDTH)[1] <= TARGET_HEIGHT):
+            low = mid
+        else:
+            high = mid - 1
+    font_size = low
+    wrap_width = MAX_WIDTH
+    lines, height = _measure(words, font_path, font_size, wrap_width)
+
+    # A title that is too tall even at MIN_FONT_SIZE keeps the smallest size
+    if height < MIN_HEIGHT:
+        # Short title: narrow the wrap width (more lines) until the block reaches the band
+        low, high = MIN_WIDTH, MAX_WIDTH
+        while low < high:
+            mid = (low + high + 1) // 2
+            if _measure(words, font_path, font_size, mid)[1] >= MIN_HEIGHT:
+                low = mid
+            else:
+                high = mid - 1
+        candidate_lines, candidate_height = _measure(words, font_path, font_size, low)
+        if candidate_height <= MAX_HEIGHT:
+            wrap_width, lines, height = low, candidate_lines, candidate_height
+
+    font = load_font(font_path, font_size)
+    line_boxes = [font.getbbox(line) for line in lines]
+    max_text_width = max((box[2] - box[0] for box in line_boxes), default=0)
+    return TitleLayout(lines, font, font_path, font_size, wrap_width, line_boxes,
+                       line_height(font_path, font_size), max_text_width, height)
@@ -0,0 +1,313 @@
+import os
+import re
+import json
+import wave
+import hashlib
+import threading
+import contextvars
+import subprocess
+import unicodedata
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+import instrumentation
+
+# Google Cloud TTS synthesis with a content-addressed on-disk audio cache.
+# The client only needs a synthesize_speech(request=...) method, so FakeTTSClient
+# (or any other stand-in) can replace the Google client for offline runs.
+
+TTS_KEY_FILE = 'google_tts_key.json'
+DEFAULT_CACHE_DIR = os.path.join("cache", "tts")
+DEFAULT_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# Duration budget: text beyond what fits in the video is never sent to the API
+MAX_AUDIO_SECONDS = 55
+CHARS_PER_SECOND = 14.0  # Approximate vi-VN Wavenet speed at speaking_rate 1.0
+CHUNK_MAX_CHARS = 300  # Sentences are grouped into chunks of about this size
+CHUNK_MAX_BYTES = 4500  # The API rejects inputs over 5000 bytes
+CHUNK_WORKERS = 4
+
+# texttospeech.AudioEncoding values, so requests can be built without importing the client library
+AUDIO_ENCODINGS = {"LINEAR16": 1, "MP3": 2, "OGG_OPUS": 3}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+# Create the Google TTS client once per process
+def get_tts_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            from google.cloud import texttospeech
+            _client = texttospeech.TextToSpeechClient.from_service_account_file(TTS_KEY_FILE)
+    return _client
+
+
+# Unicode/whitespace normalization so trivially different cells share one cache entry
+def normalize_text(text):
+    text = unicodedata.normalize('NFC', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def cache_key(text, voice_name, speaking_rate, pitch, encoding, sample_rate):
+    payload = json.dumps([
+        normalize_text(text), voice_name, float(speaking_rate), float(pitch), encoding, int(sample_rate)
+    ], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# On-disk audio cache keyed by cache_key(); least recently used entries are
+# evicted once the total size exceeds max_bytes. File mtime is the LRU clock.
+class TTSCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.audio")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)  # Atomic, so parallel workers never read partial files
+        self.evict()
+
+    def entries(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".audio"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+# Stand-in for texttospeech.TextToSpeechClient. By default it returns deterministic
+# bytes; with playable=True it returns real audio in the requested encoding (a tone
+# generated by ffmpeg) lasting audio_seconds, or the estimated speech duration of the
+# text when audio_seconds is None.
+class FakeTTSClient:
+    class Response:
+        def __init__(self, audio_content):
+            self.audio_content = audio_content
+
+    def __init__(self, playable=False, audio_seconds=None):
+        self.playable = playable
+        self.audio_seconds = audio_seconds
+        self.calls = 0
+        self.total_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def synthesize_speech(self, request):
+        text = request["input"]["text"]
+        with self._lock:
+            self.calls += 1
+        if not self.playable:
+            return self.Response(hashlib.sha256(text.encode("utf-8")).digest() * 64)
+
+        config = request["audio_config"]
+        seconds = self.audio_seconds or estimate_duration(text, config.get("speaking_rate", 1.25))
+        with self._lock:
+            self.total_seconds += seconds
+        encoding = {value: name for name, value in AUDIO_ENCODINGS.items()}[config["audio_encoding"]]
+        sample_rate = config["sample_rate_hertz"]
+        output_format = {"LINEAR16": ["-c:a", "pcm_s16le", "-f", "s16le"],
+                         "MP3": ["-c:a", "libmp3lame", "-b:a", "64k", "-f", "mp3"],
+                         "OGG_OPUS": ["-c:a", "libopus", "-f", "ogg"]}[encoding]
+        result = subprocess.run([
+            "ffmpeg", "-v", "error", "-f", "lavfi",
+            "-i", f"sine=frequency=220:sample_rate={sample_rate}:duration={seconds:.3f}",
+            "-ac", "1", *output_format, "pipe:1"
+        ], capture_output=True, check=True)
+        if encoding != "LINEAR16":
+            return self.Response(result.stdout)
+        # ffmpeg cannot fill in the WAV header sizes on a pipe; wrap the PCM like the API does
+        buffer = BytesIO()
+        with wave.open(buffer, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(sample_rate)
+            f.writeframes(result.stdout)
+        return self.Response(buffer.getvalue())
+
+
+# Synthesize text, serving repeated requests from the cache without a network call
+def synthesize(text, client=None, cache=None, language_code="vi-VN", voice_name="vi-VN-Wavenet-C",
+               speaking_rate=1.25, pitch=0.0, encoding="MP3", sample_rate=44100):
+    key = None
+    if cache is not None:
+        key = cache_key(text, voice_name, speaking_rate, pitch, encoding, sample_rate)
+        audio_content = cache.get(key)
+        if audio_content is not None:
+            instrumentation.count("tts_cache_hits")
+            return audio_content
+
+    if client is None:
+        client = get_tts_client()
+    response = client.synthesize_speech(request={
+        "input": {"text": text},
+        "voice": {"language_code": language_code, "name": voice_name},
+        "audio_config": {
+            "audio_encoding": AUDIO_ENCODINGS[encoding],
+            "speaking_rate": speaking_rate,
+            "pitch": pitch,
+            "sample_rate_hertz": sample_rate,
+        },
+    })
+    instrumentation.count("tts_api_calls")
+    instrumentation.count("bytes_downloaded", len(response.audio_content))
+    if cache is not None:
+        cache.put(key, response.audio_content)
+    return response.audio_content
+
+
+def split_sentences(text):
+    sentences = []
+    for line in text.split('\n'):
+        sentences.extend(part.strip() for part in re.split(r'(?<=[.!?…;])\s+', line) if part.strip())
+    return sentences
+
+
+def estimate_duration(text, speaking_rate=1.25):
+    return len(text) / (CHARS_PER_SECOND * speaking_rate)
+
+
+# Keep whole sentences until the estimated speech reaches max_seconds. The sentence that
+# crosses the budget is kept so estimation error does not leave the video short, but
+# an unusually long one is cut at a word boundary 10% past the budget.
+def fit_to_budget(text, speaking_rate=1.25, max_seconds=MAX_AUDIO_SECONDS):
+    kept = []
+    total = 0.0
+    limit = max_seconds * 1.1
+    for sentence in split_sentences(text):
+        if total >= max_seconds:
+            break
+        duration = estimate_duration(sentence, speaking_rate)
+        if total + duration > limit:
+            max_chars = int((limit - total) * CHARS_PER_SECOND * speaking_rate)
+            sentence = sentence[:max_chars].rsplit(" ", 1)[0]
+            duration = estimate_duration(sentence, speaking_rate)
+        kept.append(sentence)
+        total += duration
+    return kept
+
+
+# Group sentences into chunks below CHUNK_MAX_CHARS (and the API byte limit)
+def chunk_sentences(sentences, max_chars=CHUNK_MAX_CHARS):
+    chunks = []
+    current = ""
+    for sentence in sentences:
+        candidate = f"{current} {sentence}" if current else sentence
+        if current and (len(candidate) > max_chars or len(candidate.encode("utf-8")) > CHUNK_MAX_BYTES):
+            chunks.append(current)
+            current = sentence
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    # A single oversized sentence is cut at a word boundary
+    limited = []
+    for chunk in chunks:
+        while len(chunk.encode("utf-8")) > CHUNK_MAX_BYTES:
+            cut = chunk.rfind(" ", 0, CHUNK_MAX_BYTES // 4)
+            cut = cut if cut > 0 else CHUNK_MAX_BYTES // 4
+            limited.append(chunk[:cut])
+            chunk = chunk[cut:].strip()
+        limited.append(chunk)
+    return limited
+
+
+# Request texts for the part of text that fits the duration budget
+def plan_chunks(text, speaking_rate=1.25, max_seconds=MAX_AUDIO_SECONDS):
+    return chunk_sentences(fit_to_budget(text, speaking_rate, max_seconds)) or [text]
+
+
+# Synthesize every chunk, one request per chunk in parallel. Returns the audio of
+# every chunk in order.
+def synthesize_chunks(chunks, client=None, cache=None, max_workers=CHUNK_WORKERS, **params):
+    if len(chunks) == 1:
+        return [synthesize(chunks[0], client=client, cache=cache, **params)]
+    # One context copy per chunk so counters land in the caller's instrumentation span
+    contexts = [contextvars.copy_context() for _ in chunks]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as pool:
+        return list(pool.map(
+            lambda context, chunk: context.run(synthesize, chunk, client=client, cache=cache, **params),
+            contexts, chunks))
+
+
+# Synthesize only the text that fits the duration budget (see synthesize_chunks)
+def synthesize_chunked(text, client=None, cache=None, max_seconds=MAX_AUDIO_SECONDS,
+                       max_workers=CHUNK_WORKERS, **params):
+    chunks = plan_chunks(text, params.get("speaking_rate", 1.25), max_seconds)
+    return synthesize_chunks(chunks, client=client, cache=cache, max_workers=max_workers, **params)
+
+
+# Duration of a WAV file (LINEAR16 output) from its header, without decoding
+def wav_duration(path):
+    with wave.open(path, "rb") as f:
+        return f.getnframes() / f.getframerate()
+
+
+# Duration of LINEAR16 audio content (a WAV file in memory)
+def audio_content_duration(audio_content):
+    with wave.open(BytesIO(audio_content), "rb") as f:
+        return f.getnframes() / f.getframerate()
+
+
+# Join LINEAR16 chunks (WAV files in memory) into one WAV file by copying their PCM
+# frames; nothing is decoded or re-encoded
+def join_wav(chunks, output_path):
+    with wave.open(output_path, "wb") as out:
+        audio_format = None
+        for audio_content in chunks:
+            with wave.open(BytesIO(audio_content), "rb") as chunk:
+                chunk_format = (chunk.getnchannels(), chunk.getsampwidth(), chunk.getframerate())
+                if audio_format is None:
+                    audio_format = chunk_format
+                    out.setnchannels(chunk_format[0])
+                    out.setsampwidth(chunk_format[1])
+                    out.setframerate(chunk_format[2])
+                elif chunk_format != audio_format:
+                    raise ValueError(f"Audio chunks differ in format: {chunk_format} != {audio_format}")
+                out.writeframes(chunk.readframes(chunk.getnframes()))
+    return output_path
@@ -1,8 +1,12 @@
 import os
 import re
+import json
 import unicodedata
-import gspread
-from google.oauth2.service_account import Credentials
+import sheets
+import instrumentation
+import encode_budget
+import manifest
+import leases
 
 # Hàm xử lý tên file để loại bỏ dấu và ký tự đặc biệt
 def clean_filename(text, max_length=50):
@@ -21,56 +25,117 @@ def clean_filename(text, max_length=50):
         text = f"video_{random.randint(1000, 9999)}"
     return text.lower()
 
-# Read clean_title from file
-try:
-    with open(os.path.join("output", "clean_title.txt"), "r") as f:
-        clean_title = f.read().strip()
-except FileNotFoundError:
-    print("Error: clean_title.txt not found. Cannot update sheet.")
-    exit(1)
-
-# Construct raw GitHub URL
-video_url = f"https://raw.githubusercontent.com/gx288/shortvideo/main/output/output_video_{clean_title}.mp4"
-
-# Check video file size
-video_path = os.path.join("output", f"output_video_{clean_title}.mp4")
-if not os.path.exists(video_path):
-    print(f"Error: Video file {video_path} not found")
-    exit(1)
-
-file_size_mb = os.path.getsize(video_path) / (1024 * 1024)  # Convert to MB
-print(f"Video size: {file_size_mb:.2f} MB")
-
-# Update sheet
-scopes = ['https://www.googleapis.com/auth/spreadsheets']
-creds = Credentials.from_service_account_file('google_sheets_key.json', scopes=scopes)
-gc = gspread.authorize(creds)
-SHEET_ID = '14tqKftTqlesnb0NqJZU-_f1EsWWywYqO36NiuDdmaTo'
-worksheet = gc.open_by_key(SHEET_ID).worksheet('Phòng mạch')
-
-# Find row with empty column H (to handle row changes)
-rows = worksheet.get_all_values()
-selected_row_num = None
-for i, row in enumerate(rows):
-    if i == 0:  # Skip header
-        continue
-    if len(row) > 7 and (not row[7] or row[7].strip() == ''):
-        selected_row_num = i + 1
-        break
-
-if not selected_row_num:
-    print("Error: No row with empty column H found. Cannot update sheet.")
-    exit(1)
-
-try:
-    # Update column H with video URL
-    worksheet.update_cell(selected_row_num, 8, video_url)
-    print(f"Updated row {selected_row_num}, column H with {video_url}")
-    
-    # Update column I if file size > 5MB
-    if file_size_mb > 5:
-        worksheet.update_cell(selected_row_num, 9, ">5MB")
-        print(f"Updated row {selected_row_num}, column I with '>5MB'")
-except Exception as e:
-    print(f"Error updating sheet: {e}")
-    exit(1)
+OUTPUT_DIR = "output"
+RENDERED_ROWS_PATH = os.path.join(OUTPUT_DIR, "rendered_rows.json")
+
+# Rows rendered by main.py (worksheet, row, clean_title); a batch run can render several.
+# None if main.py left nothing to publish.
+def load_rendered_rows():
+    try:
+        with open(RENDERED_ROWS_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        # Read clean_title from file
+        try:
+            with open(os.path.join(OUTPUT_DIR, "clean_title.txt"), "r") as f:
+                return [{"worksheet": "Phòng mạch", "row": None, "clean_title": f.read().strip()}]
+        except FileNotFoundError:
+            print("Error: clean_title.txt not found. Cannot update sheet.")
+            return None
+
+# Publish the rendered rows (recorded as one instrumentation span): column H gets the
+# video URL and the claim is released. The videos must already be pushed. A caller
+# that keeps the sheet open (main.py --worker) passes its sheet_access. Returns the
+# entries that could not be published.
+def publish(rendered_rows, sheet_access=None):
+    with instrumentation.span("publish", rows=len(rendered_rows)):
+        # Update sheet
+        sheet_access = sheet_access or sheets.SheetAccess(sheets.open_spreadsheet())
+
+        artifacts = manifest.Manifest()
+        published = []
+        failed = []
+
+        # Column H and the claim (see leases.py) of every handed-over row, in one read
+        rows_by_worksheet = {}
+        for entry in rendered_rows:
+            if entry["row"]:
+                rows_by_worksheet.setdefault(entry["worksheet"], []).append(entry["row"])
+        current = sheet_access.fetch_cells(rows_by_worksheet, columns=("H", leases.CLAIM_COLUMN))
+
+        for entry in rendered_rows:
+            clean_title = entry["clean_title"]
+
+            # Path as recorded by main.py; the raw GitHub URL follows from it
+            video_path = entry.get("video_path") or os.path.join(OUTPUT_DIR, f"output_video_{clean_title}.mp4")
+            video_url = manifest.raw_url(video_path)
+
+            # Check video file size
+            if not os.path.exists(video_path):
+                print(f"Error: Video file {video_path} not found")
+                failed.append(entry)
+                continue
+
+            file_size_mb = os.path.getsize(video_path) / (1024 * 1024)  # Convert to MB
+            print(f"Video size: {file_size_mb:.2f} MB")
+
+            worksheet_name = entry["worksheet"]
+            selected_row_num = entry["row"]
+            if not selected_row_num:
+                # Find row with empty column H (to handle row changes)
+                rows = sheet_access.fetch_rows([worksheet_name], columns=("B", "H")).get(worksheet_name, [])
+                for i, row in enumerate(rows):
+                    if not row[7] or row[7].strip() == '':
+                        selected_row_num = i + 2  # Header is row 1
+                        break
+
+            if not selected_row_num:
+                print("Error: No row with empty column H found. Cannot update sheet.")
+                failed.append(entry)
+                continue
+
+            # Only the row this video was rendered for, and only while no other runner holds it
+            cells = current.get((worksheet_name, selected_row_num))
+            if cells is not None:
+                owner = leases.active_owner(cells[leases.CLAIM_INDEX])
+                if owner and owner != entry.get("claimed_by"):
+                    print(f"Error: Row {selected_row_num} is claimed by {owner}. Not publishing {video_path}.")
+                    failed.append(entry)
+                    continue
+                if cells[7].strip() and cells[7].strip() != video_url:
+                    print(f"Error: Row {selected_row_num} already has a video ({cells[7].strip()}). Not publishing {video_path}.")
+                    failed.append(entry)
+                    continue
+
+            # Update column H with video URL
+            sheet_access.queue_update(worksheet_name, selected_row_num, 8, video_url)
+            published.append((entry, video_path, video_url, worksheet_name, selected_row_num))
+            print(f"Queued row {selected_row_num}, column H with {video_url}")
+
+            # Release the claim in the same batch (only our own; other data in the column stays)
+            if entry.get("claimed_by") and cells is not None and leases.claim_owner(cells[leases.CLAIM_INDEX]) == entry["claimed_by"]:
+                sheet_access.queue_update(worksheet_name, selected_row_num, leases.CLAIM_INDEX + 1, "")
+
+            # Update column I if the file is over the delivery limit (main.py encodes to fit it)
+            if file_size_mb > encode_budget.TARGET_SIZE_MB:
+                sheet_access.queue_update(worksheet_name, selected_row_num, 9, ">5MB")
+                print(f"Queued row {selected_row_num}, column I with '>5MB'")
+
+        # Send all cell updates in one batch_update
+        try:
+            updated = sheet_access.flush()
+            print(f"Updated {updated} cell(s) in one batch")
+        except Exception as e:
+            print(f"Error updating sheet: {e}")
+            sheet_access.discard()
+            return failed + [entry for entry, *_ in published]
+
+        for _, video_path, video_url, worksheet_name, selected_row_num in published:
+            artifacts.record("published", video_path, url=video_url, worksheet=worksheet_name, row=selected_row_num)
+
+        return failed
+
+if __name__ == "__main__":
+    rendered_rows = load_rendered_rows()
+    if rendered_rows is None or publish(rendered_rows):
+        exit(1)